@@ -1,7 +1,11 @@
 import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional, Set, Tuple
 
+import httpx
+import orjson
 from app.core.graphs.exploration_generator import ExplorationGraphGenerator
 from app.core.graphs.key_info_generator import KeyInfoGraphGenerator
 from app.core.handlers.calculation_handler import CalculationHandler
@@ -17,11 +21,30 @@ from app.models.tree import (
     NodeState,
     ProcessingGraph,
     ProcessingNode,
+    SearchQuery,
+    SearchResultWithURL,
 )
 from fastapi import WebSocket
+from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
+# States of nodes that are being worked on, and of nodes that will still need work
+IN_PROGRESS_STATES = frozenset(
+    {NodeState.SEARCHING, NodeState.CALCULATING, NodeState.NEEDS_BREAKDOWN}
+)
+ACTIVE_STATES = IN_PROGRESS_STATES | {NodeState.BLOCKED}
+
+# Called with the results a search has gathered so far
+PartialResultsCallback = Callable[[List[SearchResultWithURL]], Awaitable[None]]
+
+
+def _json_default(obj: Any) -> Any:
+    """Fallback for orjson when an update still holds a pydantic model."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
 
 class IdeaAgent:
     """
@@ -37,11 +60,33 @@ class IdeaAgent:
         reasoning_model_dict: Dict[str, List[str]],
         normal_model_dict: Dict[str, List[str]],
         max_depth: int = 1,
+        warm_prompt_prefixes: bool = False,
+        llm_concurrency: int = 10,
+        search_concurrency: int = 20,
+        max_cached_searches: int = 256,
     ):
-        """Initialize all components needed for processing."""
+        """
+        Initialize all components needed for processing.
+
+        `warm_prompt_prefixes` enables speculative prompt-cache warm-ups for
+        calculations whose inputs are still being searched; it costs extra prefill
+        tokens, so it is off by default.
+
+        `llm_concurrency` and `search_concurrency` bound how many LLM and search
+        handler calls can be in flight at once, to stay under provider rate limits.
+
+        `max_cached_searches` caps how many completed searches are kept for reuse.
+        """
+
+        # Shared connection pool for all outbound HTTP calls made by the handlers
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=10)
+        )
 
         # Handlers
-        self.search_handler = SearchHandler(normal_model_dict)
+        self.search_handler = SearchHandler(
+            normal_model_dict, http_client=self.http_client
+        )
         self.estimate_handler = EstimateHandler(reasoning_model_dict)
         self.calculation_handler = CalculationHandler(normal_model_dict)
         self.failed_search_handler = FailedSearchBreakdownHandler(
@@ -56,13 +101,57 @@ class IdeaAgent:
 
         # Configuration
         self.max_depth = max_depth
+        self.warm_prompt_prefixes = warm_prompt_prefixes
+
+        # Bounds on concurrent outbound calls once nodes fan out
+        self._llm_sem = asyncio.Semaphore(llm_concurrency)
+        self._search_sem = asyncio.Semaphore(search_concurrency)
 
         # State tracking
         self.gathered_facts: Dict[str, str] = dict()
+        self._facts_version = 0  # Bumped whenever gathered_facts changes
+        self._depth_context_cache: Dict[Tuple[str, int, int], str] = dict()
         self.key_info_graph: Optional[ProcessingGraph] = None
         self.exploration_graph: Optional[ProcessingGraph] = None
 
-    def process_goal(
+        # Searches keyed by their payload, so identical requests share a single
+        # call: the results of completed ones (least recently used first), and the
+        # ones still in flight with the callbacks waiting on their partial results
+        self.max_cached_searches = max_cached_searches
+        self._search_cache: OrderedDict[str, List[SearchResultWithURL]] = OrderedDict()
+        self._searches_in_flight: Dict[
+            str, Tuple[asyncio.Task, List[PartialResultsCallback]]
+        ] = dict()
+
+        # IDs of nodes whose prompt prefix has been warmed, and the tasks (warm-ups
+        # and goals) still running, kept so they aren't garbage collected mid-flight
+        # and can be cancelled on close
+        self._warmed_prefixes: Set[str] = set()
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        # Set whenever a node finishes processing or gets user input, so the
+        # scheduler wakes up exactly when new nodes may have become ready
+        self._progress = asyncio.Event()
+
+    def start_goal(self, goal: str, context: str) -> asyncio.Task:
+        """Process a goal in the background, until it's done or the agent closes."""
+        return self._run_in_background(self.process_goal(goal, context))
+
+    async def aclose(self) -> None:
+        """
+        Cancel the tasks still running (their in-flight requests are aborted with
+        them), then release the HTTP connection pools.
+        """
+
+        tasks = list(self._background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        await self.search_handler.web_agent.aclose()
+        await self.http_client.aclose()
+
+    async def process_goal(
         self, goal: str, context: str
     ) -> Tuple[ProcessingGraph, ProcessingGraph]:
         """
@@ -79,14 +168,14 @@ class IdeaAgent:
         """
 
         # Phase 1: Generate and process key information needs
-        self.key_info_graph = self._gather_key_info(goal, context)
+        self.key_info_graph = await self._gather_key_info(goal, context)
 
         # Phase 2: Explore potential solutions
-        self.exploration_graph = self._explore_solutions(goal, context)
+        self.exploration_graph = await self._explore_solutions(goal, context)
 
         return self.key_info_graph, self.exploration_graph
 
-    def _gather_key_info(
+    async def _gather_key_info(
         self, goal: str, context: str, verbose: bool = False
     ) -> ProcessingGraph:
         """Gather key information through multiple rounds."""
@@ -95,7 +184,7 @@ class IdeaAgent:
 
         for depth in range(self.max_depth):
             # Generate graph for this depth
-            info_graph = self.key_info_generator.generate_graph(
+            info_graph = await self.key_info_generator.generate_graph(
                 goal=goal,
                 context=self._create_depth_context(context, depth),
                 known_facts=self.gathered_facts,
@@ -106,7 +195,7 @@ class IdeaAgent:
             processing_graph = self._create_processing_graph(info_graph)
 
             # Process all nodes at this depth
-            self._process_graph(processing_graph)
+            await self._process_graph(processing_graph)
 
             # Store processed nodes for next depth
             all_processed_nodes.extend(processing_graph.nodes)
@@ -115,14 +204,14 @@ class IdeaAgent:
             if not processing_graph.nodes:
                 break
 
-            # Print verbose information if flag is set
+            # Log verbose information if flag is set
             if verbose:
-                self._print_processing_graph(processing_graph, depth)
+                self._log_processing_graph(processing_graph, depth)
 
         # Combine all nodes into final graph
-        return ProcessingGraph(goal=goal, nodes=all_processed_nodes)
+        return ProcessingGraph.from_nodes(goal=goal, nodes=all_processed_nodes)
 
-    def _explore_solutions(
+    async def _explore_solutions(
         self, goal: str, context: str, verbose: bool = False
     ) -> ProcessingGraph:
         """Explore solutions through multiple rounds."""
@@ -131,7 +220,7 @@ class IdeaAgent:
 
         for depth in range(self.max_depth):
             # Generate graph for this depth
-            exploration_graph = self.exploration_generator.generate_graph(
+            exploration_graph = await self.exploration_generator.generate_graph(
                 goal=goal,
                 context=self._create_depth_context(context, depth),
                 key_info=self.gathered_facts,
@@ -142,7 +231,7 @@ class IdeaAgent:
             processing_graph = self._create_processing_graph(exploration_graph)
 
             # Process all nodes at this depth
-            self._process_graph(processing_graph)
+            await self._process_graph(processing_graph)
 
             # Store processed nodes for next depth
             all_processed_nodes.extend(processing_graph.nodes)
@@ -151,50 +240,81 @@ class IdeaAgent:
             if not processing_graph.nodes:
                 break
 
-            # Print verbose information if flag is set
+            # Log verbose information if flag is set
             if verbose:
-                self._print_processing_graph(processing_graph, depth)
+                self._log_processing_graph(processing_graph, depth)
 
         # Combine all nodes into final graph
-        return ProcessingGraph(goal=goal, nodes=all_processed_nodes)
+        return ProcessingGraph.from_nodes(goal=goal, nodes=all_processed_nodes)
 
-    def _print_processing_graph(self, graph: ProcessingGraph, depth: int) -> None:
-        """Print the main information in the processing graph."""
-        print(f"\nDepth {depth}: Processing Graph for goal '{graph.goal}'")
+    def _log_processing_graph(self, graph: ProcessingGraph, depth: int) -> None:
+        """Log the main information in the processing graph at debug level."""
+
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+
+        logger.debug(f"Depth {depth}: Processing Graph for goal '{graph.goal}'")
         for node in graph.nodes:
-            print(f"Node ID: {node.id}")
-            print(f"  Question: {node.question}")
-            print(f"  Rationale: {node.rationale}")
-            print(f"  Node Type: {node.node_type}")
-            print(f"  State: {node.state}")
-            print(f"  Value: {node.value}")
-            print(f"  Value Source: {node.value_source}")
-            print(f"  Depends On: {node.depends_on_ids}")
-            print(f"  Gathering Method: {node.gathering_method}")
-            print(f"  Search Queries: {node.search_queries}")
-            print(f"  Calculation Code: {node.calculation_code}")
-            print(f"  Calculation Explanation: {node.calculation_explanation}")
-            print(f"  Input Node IDs: {node.input_node_ids}")
-            print(f"  Calculation Result: {node.calculation_result}")
-            print(f"  Breakdown Attempt: {node.breakdown_attempt}")
-            print(f"  Estimate: {node.estimate}")
-            print(f"  Search Results: {node.search_results}")
-            print()
+            logger.debug(
+                "\n".join(
+                    [
+                        f"Node ID: {node.id}",
+                        f"  Question: {node.question}",
+                        f"  Rationale: {node.rationale}",
+                        f"  Node Type: {node.node_type}",
+                        f"  State: {node.state}",
+                        f"  Value: {node.value}",
+                        f"  Value Source: {node.value_source}",
+                        f"  Depends On: {node.depends_on_ids}",
+                        f"  Gathering Method: {node.gathering_method}",
+                        f"  Search Queries: {node.search_queries}",
+                        f"  Calculation Code: {node.calculation_code}",
+                        f"  Calculation Explanation: {node.calculation_explanation}",
+                        f"  Input Node IDs: {node.input_node_ids}",
+                        f"  Calculation Result: {node.calculation_result}",
+                        f"  Breakdown Attempt: {node.breakdown_attempt}",
+                        f"  Estimate: {node.estimate}",
+                        f"  Search Results: {node.search_results}",
+                    ]
+                )
+            )
+
+    def _record_fact(self, question: str, value: str) -> None:
+        """Add a gathered fact, invalidating anything built from the old facts."""
+        self.gathered_facts[question] = value
+        self._facts_version += 1
 
     def _create_depth_context(self, base_context: str, depth: int) -> str:
-        """Create context string appropriate for the current depth."""
+        """
+        Create context string appropriate for the current depth.
 
-        context_parts = [base_context]
+        Memoized until the gathered facts change, so repeated calls return the
+        exact same string (and the same cacheable prompt prefix).
+        """
 
-        # Add information about current depth
-        context_parts.append(f"\nCurrent exploration depth: {depth}")
+        cache_key = (base_context, depth, self._facts_version)
+        if cache_key not in self._depth_context_cache:
+            self._depth_context_cache[cache_key] = self._build_depth_context(
+                base_context, depth
+            )
+        return self._depth_context_cache[cache_key]
+
+    def _build_depth_context(self, base_context: str, depth: int) -> str:
+        """Build the context string for the current depth from scratch."""
+
+        # Stable parts come first so the prompt prefix can be cached by the provider;
+        # facts are sorted so the prefix doesn't depend on insertion order
+        context_parts = [base_context]
 
         # Add gathered information
         if self.gathered_facts:
             context_parts.append("\nInformation gathered so far:")
-            for key, value in self.gathered_facts.items():
+            for key, value in sorted(self.gathered_facts.items()):
                 context_parts.append(f"- {key}: {value}")
 
+        # Add information about current depth
+        context_parts.append(f"\nCurrent exploration depth: {depth}")
+
         return "\n".join(context_parts)
 
     def _create_processing_graph(
@@ -202,31 +322,20 @@ class IdeaAgent:
     ) -> ProcessingGraph:
         """Convert info graph to processing graph."""
 
-        processing_nodes = []
-        for node in info_graph.graph.nodes:
-            processing_nodes.append(
-                ProcessingNode(
-                    id=node.id,
-                    question=node.question,
-                    rationale=node.rationale,
-                    node_type=node.node_type,
-                    depends_on_ids=node.depends_on_ids,
-                    gathering_method=node.gathering_method,
-                    search_queries=node.search_queries,
-                    calculation_code=node.calculation_code,
-                    calculation_explanation=node.calculation_explanation,
-                    input_node_ids=node.input_node_ids,
-                )
-            )
+        # The info graph was already validated when it was parsed from the LLM
+        # response, so build the processing nodes without re-validating every field
+        processing_nodes = [
+            ProcessingNode.from_spec(node) for node in info_graph.graph.nodes
+        ]
 
-        return ProcessingGraph(
+        return ProcessingGraph.from_nodes(
             goal=info_graph.goal,
             nodes=processing_nodes,
         )
 
-    def _process_graph(self, graph: ProcessingGraph) -> None:
+    async def _process_graph(self, graph: ProcessingGraph) -> None:
         """
-        Process all nodes in a graph.
+        Process all nodes in a graph, each wave of ready nodes concurrently.
 
         Handles:
         - Dependencies between nodes
@@ -239,48 +348,43 @@ class IdeaAgent:
             # Find nodes that are ready to process
             ready_nodes = self._get_ready_nodes(graph)
             if not ready_nodes:
-                # If no nodes are ready and none are in progress,
-                # we're done
-                if not self._has_in_progress_nodes(graph):
+                # If no nodes are ready and none are active, we're done
+                if not self._has_active_nodes(graph):
                     break
+
+                # Sleep until some node makes progress instead of polling
+                await self._progress.wait()
+                self._progress.clear()
                 continue
 
-            # Process ready nodes
-            for node in ready_nodes:
-                self._process_node(node, graph)
+            # Process the whole wave of ready nodes concurrently; nodes that end up
+            # blocked on user input are picked back up by the next iteration. Tasks
+            # are named after their node so async profilers attribute await time
+            # to the right node
+            await asyncio.gather(
+                *(
+                    asyncio.create_task(
+                        self._process_node(node, graph),
+                        name=(
+                            f"node:{(node.gathering_method or node.node_type).value}"
+                            f":{node.id}"
+                        ),
+                    )
+                    for node in ready_nodes
+                ),
+                return_exceptions=True,
+            )
 
     def _get_ready_nodes(self, graph: ProcessingGraph) -> List[ProcessingNode]:
         """Get nodes that are ready to be processed."""
 
-        ready_nodes = []
-        for node in graph.nodes:
-            if node.state != NodeState.PENDING:
-                continue
-
-            # Check if dependencies are complete
-            deps_complete = True
-            for dep_id in node.depends_on_ids:
-                dep_node = next(n for n in graph.nodes if n.id == dep_id)
-                if dep_node.state != NodeState.COMPLETE:
-                    deps_complete = False
-                    break
-
-            if deps_complete:
-                ready_nodes.append(node)
+        return graph.pop_ready()
 
-        return ready_nodes
-
-    def _has_in_progress_nodes(self, graph: ProcessingGraph) -> bool:
+    def _has_active_nodes(self, graph: ProcessingGraph) -> bool:
         """Check if any nodes are still in progress."""
+        return any(node.state in IN_PROGRESS_STATES for node in graph.nodes)
 
-        in_progress_states = {
-            NodeState.SEARCHING,
-            NodeState.CALCULATING,
-            NodeState.NEEDS_BREAKDOWN,
-        }
-        return any(node.state in in_progress_states for node in graph.nodes)
-
-    def _process_node(self, node: ProcessingNode, graph: ProcessingGraph) -> None:
+    async def _process_node(self, node: ProcessingNode, graph: ProcessingGraph) -> None:
         """
         Process a single node based on its type.
 
@@ -289,38 +393,43 @@ class IdeaAgent:
 
         try:
             if node.node_type == "gather":
-                self._process_gather_node(node)
+                await self._process_gather_node(node)
             elif node.node_type == "calculate":
-                self._process_calculate_node(node, graph)
+                await self._process_calculate_node(node, graph)
 
             # If we got a value, update gathered facts
             if node.value is not None:
-                self.gathered_facts[node.question] = node.value
+                self._record_fact(node.question, node.value)
 
             node.state = NodeState.COMPLETE
+            graph.mark_complete(node.id)
 
-        except Exception as e:
-            print(f"Error processing node {node.id}: {str(e)}")
+        except Exception:
+            logger.exception(f"Error processing node {node.id}")
             node.state = NodeState.BLOCKED
 
-    def _process_gather_node(self, node: ProcessingNode) -> None:
+        finally:
+            self._progress.set()
+
+    async def _process_gather_node(self, node: ProcessingNode) -> None:
         """Process a gather node (search or user input)."""
 
         if node.gathering_method == "web_search":
             node.state = NodeState.SEARCHING
-            results = self.search_handler.search_and_analyze(
-                node.question, node.search_queries
-            )
+            results = await self._search_and_analyze(node.question, node.search_queries)
 
             if not results:
                 # Try breaking down the search
                 node.state = NodeState.NEEDS_BREAKDOWN
-                failed_attempt = self.failed_search_handler.handle_failed_search(
-                    question=node.question,
-                    context=self._get_context_for_node(node),
-                    failed_searches=[q.query for q in node.search_queries],
-                    known_facts=self.gathered_facts,
-                )
+                async with self._llm_sem:
+                    failed_attempt = (
+                        await self.failed_search_handler.handle_failed_search(
+                            question=node.question,
+                            context=self._get_context_for_node(node),
+                            failed_searches=list(node.query_strings),
+                            known_facts=self.gathered_facts,
+                        )
+                    )
 
                 node.breakdown_attempt = failed_attempt.breakdown_attempt
 
@@ -345,7 +454,7 @@ class IdeaAgent:
             # Wait for user to provide input through set_user_input
             # The orchestrator above will continue processing other nodes
 
-    def _process_calculate_node(
+    async def _process_calculate_node(
         self, node: ProcessingNode, graph: ProcessingGraph
     ) -> None:
         """Process a calculate node."""
@@ -355,22 +464,133 @@ class IdeaAgent:
         # Get input values from dependencies
         input_values = {}
         for input_id in node.input_node_ids:
-            input_node = next(n for n in graph.nodes if n.id == input_id)
-            input_values[input_id] = input_node.value
+            input_values[input_id] = graph.node_by_id[input_id].value
 
         # Generate and run calculation
-        calculation = self.calculation_handler.generate_calculation(
-            node.question, input_values
-        )
+        async with self._llm_sem:
+            calculation = await self.calculation_handler.generate_calculation(
+                node.question, input_values
+            )
 
-        result = self.calculation_handler.execute_calculation(
-            calculation, input_values
+        result = await asyncio.to_thread(
+            self.calculation_handler.execute_calculation,
+            calculation,
+            input_values,
         )
 
         node.value = str(result.result)
         node.value_source = "calculation"
         node.calculation_result = result.result
 
+    async def _search_and_analyze(
+        self,
+        question: str,
+        search_queries: List[SearchQuery],
+        on_partial_results: Optional[PartialResultsCallback] = None,
+    ) -> List[SearchResultWithURL]:
+        """
+        Run a search through the search handler, reusing the result of an earlier
+        identical search or joining one that is still in flight.
+
+        `on_partial_results` is awaited with the results gathered so far each time
+        another page has been analyzed, for every caller waiting on the search
+        (callers that join late get everything gathered so far with the next page).
+        """
+
+        payload = {"q": question, "sq": [q.query for q in search_queries]}
+        key = hashlib.blake2b(
+            orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+        ).hexdigest()
+
+        cached = self._search_cache.get(key)
+        if cached is not None:
+            self._search_cache.move_to_end(key)
+            return list(cached)
+
+        in_flight = self._searches_in_flight.get(key)
+        if in_flight is None:
+            listeners: List[PartialResultsCallback] = []
+
+            async def search() -> List[SearchResultWithURL]:
+                results: List[SearchResultWithURL] = []
+                async with self._search_sem:
+                    async for (
+                        page_results
+                    ) in self.search_handler.iter_search_and_analyze(
+                        question, search_queries
+                    ):
+                        results.extend(page_results)
+                        for listener in list(listeners):
+                            try:
+                                await listener(list(results))
+                            except Exception as e:
+                                # One waiter failing shouldn't stop the search
+                                logger.warning(f"Error sending partial results: {e}")
+                return results
+
+            def finish(t: asyncio.Task) -> None:
+                self._searches_in_flight.pop(key, None)
+                # Only successful searches are worth sharing
+                if t.cancelled() or t.exception() is not None:
+                    return
+                self._search_cache[key] = t.result()
+                if len(self._search_cache) > self.max_cached_searches:
+                    self._search_cache.popitem(last=False)
+
+            # Tracked like the goal tasks, so closing the agent cancels it too
+            task = self._run_in_background(search())
+            task.add_done_callback(finish)
+            in_flight = (task, listeners)
+            self._searches_in_flight[key] = in_flight
+
+        task, listeners = in_flight
+        if on_partial_results is not None:
+            listeners.append(on_partial_results)
+        try:
+            # Shield the shared task so one cancelled caller doesn't cancel the others
+            return list(await asyncio.shield(task))
+        finally:
+            if on_partial_results is not None:
+                listeners.remove(on_partial_results)
+
+    def _warm_dependent_prefixes(
+        self, node: ProcessingNode, graph: ProcessingGraph
+    ) -> None:
+        """
+        Start prompt-cache warm-ups for calculate nodes that are only waiting on
+        `node`, so their real LLM call hits a cached prefix. Fire-and-forget.
+        """
+
+        if not self.warm_prompt_prefixes:
+            return
+
+        for dependent_id in graph.dependents.get(node.id, []):
+            dependent = graph.node_by_id[dependent_id]
+            if (
+                dependent.node_type != "calculate"
+                or dependent_id in self._warmed_prefixes
+            ):
+                continue
+
+            other_deps_complete = all(
+                graph.node_by_id[dep_id].state == NodeState.COMPLETE
+                for dep_id in dependent.depends_on_ids
+                if dep_id != node.id
+            )
+            if other_deps_complete:
+                self._warmed_prefixes.add(dependent_id)
+                self._run_in_background(
+                    self.calculation_handler.warm_prefix(dependent.question)
+                )
+
+    def _run_in_background(self, coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+        """Start a task that is tracked until it finishes."""
+
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
     def _get_context_for_node(self, node: ProcessingNode) -> str:
         """Generate context string for a node."""
         return f"Attempting to answer: {node.question}\nRationale: {node.rationale}"
@@ -391,20 +611,20 @@ class IdeaAgent:
             if not graph:
                 continue
 
-            for node in graph.nodes:
-                if node.id == node_id:
-                    if (
-                        node.state != NodeState.BLOCKED
-                        or node.gathering_method != "ask_user"
-                    ):
-                        raise ValueError(
-                            f"Node {node_id} is not waiting for user input"
-                        )
-                    node.value = user_input
-                    node.value_source = "user"
-                    node.state = NodeState.COMPLETE
-                    self.gathered_facts[node.question] = user_input
-                    return
+            node = graph.node_by_id.get(node_id)
+            if node:
+                if (
+                    node.state != NodeState.BLOCKED
+                    or node.gathering_method != "ask_user"
+                ):
+                    raise ValueError(f"Node {node_id} is not waiting for user input")
+                node.value = user_input
+                node.value_source = "user"
+                node.state = NodeState.COMPLETE
+                graph.mark_complete(node.id)
+                self._record_fact(node.question, user_input)
+                self._progress.set()
+                return
 
         raise ValueError(f"Node {node_id} not found")
 
@@ -413,71 +633,128 @@ class IdeaAgent:
 
 
 class ConnectionManager:
-    def __init__(self):
+    """
+    Routes updates to session websockets. Updates are queued and sent by a single
+    writer task per session, which batches everything that piled up since its last
+    send into one frame.
+
+    After the first update of a batch, the writer waits `coalesce_window` seconds
+    so updates that come right after it (e.g. a node's state and value updates)
+    share its frame.
+    """
+
+    def __init__(self, coalesce_window: float = 0.005):
+        self.coalesce_window = coalesce_window
         self.active_connections: Dict[str, WebSocket] = dict()
+        self.queues: Dict[str, asyncio.Queue] = dict()
+        self.writers: Dict[str, asyncio.Task] = dict()
 
     async def connect(self, websocket: WebSocket, session_id: str):
         await websocket.accept()
+
+        # A reconnect replaces the old connection; stop its writer first
+        self.disconnect(session_id)
         self.active_connections[session_id] = websocket
 
+        queue = asyncio.Queue()
+        self.queues[session_id] = queue
+        self.writers[session_id] = asyncio.create_task(self._drain(websocket, queue))
+
     def disconnect(self, session_id: str):
         self.active_connections.pop(session_id, None)
+        self.queues.pop(session_id, None)
+        if writer := self.writers.pop(session_id, None):
+            writer.cancel()
 
     async def send_update(self, session_id: str, data: dict):
-        if websocket := self.active_connections.get(session_id):
-            await websocket.send_json(data)
+        if queue := self.queues.get(session_id):
+            queue.put_nowait(data)
+
+    async def _drain(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Send queued updates, coalescing whatever is pending into one frame."""
+
+        while True:
+            updates = [await queue.get()]
+            if self.coalesce_window > 0:
+                await asyncio.sleep(self.coalesce_window)
+            while not queue.empty():
+                updates.append(queue.get_nowait())
+
+            message = updates[0]
+            if len(updates) > 1:
+                message = {"type": "batch", "updates": updates}
+
+            try:
+                # orjson encodes in C; send as text so browsers still get a string
+                await websocket.send_text(
+                    orjson.dumps(message, default=_json_default).decode("utf-8")
+                )
+            except Exception as e:
+                logger.error(f"Error sending updates: {str(e)}")
+                return
 
 
 class WebSocketIdeaAgent(IdeaAgent):
-    def __init__(self, session_id: str, *args, **kwargs):
+    def __init__(self, session_id: str, manager: ConnectionManager, *args, **kwargs):
+        """
+        `manager` is the app-wide ConnectionManager that routes updates to this
+        session's websocket.
+        """
+
         super().__init__(*args, **kwargs)
 
-        self.manager = ConnectionManager()
+        self.manager = manager
         self.session_id = session_id
 
     async def process_goal(self, goal: str, context: str):
         """Override to send initial graphs after generation."""
 
-        # Generate initial graphs
-        key_info_graph = self.key_info_generator.generate_graph(
-            goal=goal,
-            context=context,
-            known_facts=self.gathered_facts,
-            explored_nodes=[],
+        # Generate both initial graphs concurrently; the generators share no state
+        key_info_graph, exploration_graph = await asyncio.gather(
+            self.key_info_generator.generate_graph(
+                goal=goal,
+                context=context,
+                known_facts=self.gathered_facts,
+                explored_nodes=[],
+            ),
+            self.exploration_generator.generate_graph(
+                goal=goal,
+                context=context,
+                key_info=self.gathered_facts,
+                explored_nodes=[],
+            ),
         )
 
-        key_info_processing_graph = self._create_processing_graph(key_info_graph)
+        self.key_info_graph = self._create_processing_graph(key_info_graph)
+        self.exploration_graph = self._create_processing_graph(exploration_graph)
 
-        # Send initial key info graph
+        # Send initial graphs
         await self.manager.send_update(
             self.session_id,
             {
                 "type": "initial_key_info_graph",
-                "graph": key_info_processing_graph.model_dump(),
+                "graph": self.key_info_graph.model_dump(),
             },
         )
-
-        # Generate exploration graph
-        exploration_graph = self.exploration_generator.generate_graph(
-            goal=goal, context=context, key_info=self.gathered_facts, explored_nodes=[]
-        )
-
-        exploration_processing_graph = self._create_processing_graph(exploration_graph)
-
-        # Send initial exploration graph
         await self.manager.send_update(
             self.session_id,
             {
                 "type": "initial_exploration_graph",
-                "graph": exploration_processing_graph.model_dump(),
+                "graph": self.exploration_graph.model_dump(),
             },
         )
 
-        # Process graphs (with updates for each node)
-        # await self._process_graph(key_info_graph)
-        await self._process_graph(exploration_graph)
+        # Process both graphs concurrently (with updates for each node)
+        await asyncio.gather(
+            asyncio.create_task(
+                self._process_graph(self.key_info_graph), name="graph:key_info"
+            ),
+            asyncio.create_task(
+                self._process_graph(self.exploration_graph), name="graph:exploration"
+            ),
+        )
 
-        return key_info_graph, exploration_graph
+        return self.key_info_graph, self.exploration_graph
 
     async def _process_node(self, node: ProcessingNode, graph: ProcessingGraph):
         """Override to send updates at each step of node processing."""
@@ -490,9 +767,28 @@ class WebSocketIdeaAgent(IdeaAgent):
                 if node.gathering_method == "web_search":
                     node.state = NodeState.SEARCHING
                     await self._send_node_state_update(node)
-
-                    results = self.search_handler.search_and_analyze(
-                        node.question, node.search_queries
+                    self._warm_dependent_prefixes(node, graph)
+
+                    # Results sent so far. The node holds this same list while
+                    # streaming, so each update only dumps and sends the new ones
+                    streamed: List[SearchResultWithURL] = []
+
+                    async def send_partial_results(
+                        partial: List[SearchResultWithURL],
+                    ) -> None:
+                        # Stream what has been found so far; `partial` always
+                        # starts with the results that were already streamed
+                        sent = len(streamed)
+                        streamed.extend(partial[sent:])
+                        node.value = "; ".join(r.search_result.fact for r in streamed)
+                        node.value_source = "search"
+                        node.search_results = streamed
+                        await self._send_node_value_update(node, sent)
+
+                    results = await self._search_and_analyze(
+                        node.question,
+                        node.search_queries,
+                        on_partial_results=send_partial_results,
                     )
 
                     if not results:
@@ -500,14 +796,15 @@ class WebSocketIdeaAgent(IdeaAgent):
                         node.state = NodeState.NEEDS_BREAKDOWN
                         await self._send_node_state_update(node)
 
-                        failed_attempt = (
-                            self.failed_search_handler.handle_failed_search(
-                                question=node.question,
-                                context=self._get_context_for_node(node),
-                                failed_searches=[q.query for q in node.search_queries],
-                                known_facts=self.gathered_facts,
+                        async with self._llm_sem:
+                            failed_attempt = (
+                                await self.failed_search_handler.handle_failed_search(
+                                    question=node.question,
+                                    context=self._get_context_for_node(node),
+                                    failed_searches=list(node.query_strings),
+                                    known_facts=self.gathered_facts,
+                                )
                             )
-                        )
 
                         # Send breakdown nodes
                         await self._send_breakdown_update(
@@ -525,13 +822,21 @@ class WebSocketIdeaAgent(IdeaAgent):
                             node.value = failed_attempt.estimate.value
                             node.value_source = "estimate"
                             await self._send_node_value_update(node)
-                            return
 
-                    # Update with search results
-                    node.value = "; ".join(r.search_result.fact for r in results)
-                    node.value_source = "search"
-                    node.search_results = results
-                    await self._send_node_value_update(node)
+                    if results:
+                        # Update with search results; if they start with the ones
+                        # that were streamed, add the rest to the streamed list so
+                        # only they need to go out
+                        sent = len(streamed)
+                        if sent and results[:sent] == streamed:
+                            streamed.extend(results[sent:])
+                            results = streamed
+                        else:
+                            sent = 0
+                        node.value = "; ".join(r.search_result.fact for r in results)
+                        node.value_source = "search"
+                        node.search_results = results
+                        await self._send_node_value_update(node, sent)
 
             elif node.gathering_method == "ask_user":
                 # Set state to blocked until we get user input
@@ -545,30 +850,13 @@ class WebSocketIdeaAgent(IdeaAgent):
             elif node.node_type == "calculate":
                 node.state = NodeState.CALCULATING
                 await self._send_node_state_update(node)
-
-                # Get input values from dependencies
-                input_values = {}
-                for input_id in node.input_node_ids:
-                    input_node = next(n for n in graph.nodes if n.id == input_id)
-                    input_values[input_id] = input_node.value
-
-                # Generate and run calculation
-                calculation = self.calculation_handler.generate_calculation(
-                    node.question, input_values
-                )
-
-                result = self.calculation_handler.execute_calculation(
-                    calculation, input_values
-                )
-
-                node.value = str(result.result)
-                node.value_source = "calculation"
-                node.calculation_result = result.result
+                await self._process_calculate_node(node, graph)
 
                 # Send updates for calculation results
                 await self._send_node_value_update(node)
 
             node.state = NodeState.COMPLETE
+            graph.mark_complete(node.id)
             await self._send_node_state_update(node)
 
         except Exception as e:
@@ -576,6 +864,9 @@ class WebSocketIdeaAgent(IdeaAgent):
             node.state = NodeState.BLOCKED
             await self._send_node_state_update(node)
 
+        finally:
+            self._progress.set()
+
     async def _send_node_state_update(self, node: ProcessingNode):
         """Send update when node state changes."""
 
@@ -584,24 +875,29 @@ class WebSocketIdeaAgent(IdeaAgent):
             {"type": "node_state_update", "node_id": node.id, "state": node.state},
         )
 
-    async def _send_node_value_update(self, node: ProcessingNode):
-        """Send update when node gets a value."""
+    async def _send_node_value_update(
+        self, node: ProcessingNode, results_sent: int = 0
+    ):
+        """
+        Send update when node gets a value. If the client already has the first
+        `results_sent` search results, only the rest are sent, with
+        `search_results_offset` telling the client where they go.
+        """
 
-        await self.manager.send_update(
-            self.session_id,
-            {
-                "type": "node_value_update",
-                "node_id": node.id,
-                "value": node.value,
-                "value_source": node.value_source,
-                "search_results": [res.model_dump() for res in node.search_results],
-                "calculation_result": node.calculation_result,
-            },
-        )
+        update = {
+            "type": "node_value_update",
+            "node_id": node.id,
+            "value": node.value,
+            "value_source": node.value_source,
+            "search_results": node.dump_search_results()[results_sent:],
+            "calculation_result": node.calculation_result,
+        }
+        if results_sent:
+            update["search_results_offset"] = results_sent
 
-    async def _send_breakdown_update(
-        self, breakdown: BreakdownAttempt, parent_id: str
-    ):
+        await self.manager.send_update(self.session_id, update)
+
+    async def _send_breakdown_update(self, breakdown: BreakdownAttempt, parent_id: str):
         """Send update when new breakdown nodes are created."""
 
         update = {
@@ -634,19 +930,11 @@ class WebSocketIdeaAgent(IdeaAgent):
         node = None
         graph = None
 
-        if self.key_info_graph:
-            for n in self.key_info_graph.nodes:
-                if n.id == node_id:
-                    node = n
-                    graph = self.key_info_graph
-                    break
-
-        if not node and self.exploration_graph:
-            for n in self.exploration_graph.nodes:
-                if n.id == node_id:
-                    node = n
-                    graph = self.exploration_graph
-                    break
+        for candidate in [self.key_info_graph, self.exploration_graph]:
+            if candidate and node_id in candidate.node_by_id:
+                node = candidate.node_by_id[node_id]
+                graph = candidate
+                break
 
         if not node:
             raise ValueError(f"Node {node_id} not found")
@@ -663,56 +951,15 @@ class WebSocketIdeaAgent(IdeaAgent):
 
         # Update state to complete
         node.state = NodeState.COMPLETE
+        graph.mark_complete(node.id)
         await self._send_node_state_update(node)
 
         # Add to gathered facts
-        self.gathered_facts[node.question] = user_input
-
-        # Continue processing the graph
-        # Find nodes that were waiting on this one
-        if graph:
-            dependent_nodes = [
-                n
-                for n in graph.nodes
-                if node_id in n.depends_on_ids and n.state == NodeState.PENDING
-            ]
-
-            # Process them
-            for dep_node in dependent_nodes:
-                await self._process_node(dep_node, graph)
-
-    async def _process_graph(self, graph: InitialInfoGraphWithGoal):
-        """Process all nodes in a graph with user input handling."""
-
-        # Convert to processing graph
-        processing_graph = self._create_processing_graph(graph)
-
-        while True:
-            # Find nodes that are ready to process
-            ready_nodes = self._get_ready_nodes(processing_graph)
-            if not ready_nodes:
-                # If no nodes are ready and none are blocked or in progress,
-                # we're done
-                if not self._has_active_nodes(processing_graph):
-                    break
-                await asyncio.sleep(0.1)  # Small delay to prevent busy waiting
-                continue
+        self._record_fact(node.question, user_input)
 
-            # Process ready nodes
-            for node in ready_nodes:
-                await self._process_node(node, processing_graph)
-
-                # If node is blocked (waiting for user input), pause processing
-                if node.state == NodeState.BLOCKED:
-                    break
+        # Wake the running scheduler; it owns dispatch of the released dependents
+        self._progress.set()
 
     def _has_active_nodes(self, graph: ProcessingGraph) -> bool:
-        """Check if any nodes are still active (in progress or blocked)."""
-
-        active_states = {
-            NodeState.SEARCHING,
-            NodeState.CALCULATING,
-            NodeState.NEEDS_BREAKDOWN,
-            NodeState.BLOCKED,
-        }
-        return any(node.state in active_states for node in graph.nodes)
+        """Check if any nodes are still active (in progress or awaiting user input)."""
+        return any(node.state in ACTIVE_STATES for node in graph.nodes)
@@ -1,22 +1,127 @@
+import asyncio
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Optional
+import sys
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-import requests
-from app.caching import ContentFileCache, PerplexityFileCache
+import httpx
+import lxml.html
+import orjson
+from app.caching import (
+    ContentFileCache,
+    PerplexityFileCache,
+    SemanticCache,
+    get_shared_redis_cache,
+)
+from app.caching.redis_cache import CACHE_TTLS
+from app.llm.base import get_shared_semantic_cache
 from app.models.cache import PerplexityCallRecord, URLScrapeRecord
-from bs4 import BeautifulSoup
 from readability import Document
 
 logger = logging.getLogger(__name__)
 
+# Query parameters that only track where a visitor came from. Generic names like
+# "ref" are left alone, since many sites use them for the content itself
+TRACKING_PARAMS = {"fbclid", "gclid", "msclkid"}
+TRACKING_PARAM_PREFIXES = ("utm_", "mc_")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Sent first and unchanged with every search, so the provider can cache the prefix
+PERPLEXITY_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "Be specific and precise. Follow every detail in the query",
+}
+
+
+def extract_readable_text(html: str) -> str:
+    """
+    Extract the main content of a page as text, one stripped text fragment per
+    line. Uses readability's own lxml tree output directly instead of re-parsing
+    it with BeautifulSoup.
+    """
+
+    readable_html = Document(html).summary(html_partial=True)
+    if not readable_html.strip():
+        return ""
+
+    # Same output as BeautifulSoup's get_text(separator="\n", strip=True), but each
+    # fragment is only stripped once and no second DOM is built
+    tree = lxml.html.fromstring(readable_html)
+    return "\n".join(
+        [stripped for fragment in tree.itertext() if (stripped := fragment.strip())]
+    )
+
+
+def truncate_utf8(text: str, max_bytes: int) -> str:
+    """Truncate `text` to at most `max_bytes` of UTF-8 without splitting a char."""
+
+    # No UTF-8 character is wider than 4 bytes
+    if len(text) * 4 <= max_bytes:
+        return text
+
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", errors="ignore")
+
+
+@lru_cache(maxsize=4096)
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL so links to the same page compare equal: lowercase scheme and
+    host, no default port, fragment or tracking parameters. Unparseable URLs are
+    returned unchanged.
+
+    The same sources get cited by many searches, so results are cached.
+    """
+
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname or ""
+    if ":" in netloc:
+        netloc = f"[{netloc}]"  # IPv6
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{port}"
+
+    query = urlencode(
+        [
+            (k, v)
+            for k, v in parse_qsl(parts.query, keep_blank_values=True)
+            if not k.startswith(TRACKING_PARAM_PREFIXES) and k not in TRACKING_PARAMS
+        ]
+    )
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def unique_urls(urls: List[str]) -> List[str]:
+    """The first of each set of URLs with the same canonical form, in order."""
+
+    unique: Dict[str, str] = {}
+    for url in urls:
+        unique.setdefault(canonicalize_url(url), url)
+    return list(unique.values())
+
 
 class WebAgent:
     """
     Provides:
-        1) A 'search' method that queries Perplexity.
-        2) A 'scrape_citations' method that fetches the cited pages concurrently.
+        1) An async 'search' method that queries Perplexity.
+        2) An async 'scrape_citations' method that fetches the cited pages
+           concurrently.
+
+    Pass in a shared `httpx.AsyncClient` to reuse its connection pool for scraping;
+    otherwise the agent creates (and owns) its own. Perplexity requests always go
+    through the agent's own authenticated client.
+
+    Searches are answered from the semantic cache when it's turned on (see
+    SEMANTIC_CACHE_THRESHOLD) and a similar query was made with the same model.
     """
 
     def __init__(
@@ -24,25 +129,49 @@ class WebAgent:
         perplexity_model: str = "llama-3.1-sonar-large-128k-online",
         perplexity_request_timeout: int = 30,
         scrape_citations_timeout: int = 10,
+        http_client: Optional[httpx.AsyncClient] = None,
+        max_concurrent_scrapes: int = 32,
+        max_content_bytes: int = 65536,
+        semantic_cache: Optional[SemanticCache] = None,
     ):
+        self.owns_http_client = http_client is None
+        self.http_client = http_client or httpx.AsyncClient()
         self.api_key = os.getenv("PERPLEXITY_API_KEY")
         self.perplexity_model = perplexity_model
         self.perplexity_cache = PerplexityFileCache()
         self.content_cache = ContentFileCache()
+        self.redis_cache = get_shared_redis_cache(PerplexityCallRecord, "perplexity")
+        self.semantic_cache = semantic_cache or get_shared_semantic_cache()
+        if self.semantic_cache is not None:
+            self.semantic_cache.index_cache(self.perplexity_cache)
         self.perplexity_request_timeout = perplexity_request_timeout
         self.scrape_citations_timeout = scrape_citations_timeout
+        self._scrape_sem = asyncio.Semaphore(max_concurrent_scrapes)
+        # Scraped pages are cut to this many bytes of text before being cached
+        self.max_content_bytes = max_content_bytes
         self.perplexity_url = "https://api.perplexity.ai/chat/completions"
 
-    def search(self, query: str) -> List[str]:
+        # Perplexity gets its own keep-alive pool with the auth headers baked in,
+        # so scraping can't evict its connections and the API key is never sent to
+        # scraped sites
+        self.perplexity_client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        )
+
+    async def aclose(self) -> None:
+        """Close the Perplexity client, and the HTTP client if this agent created it."""
+        await self.perplexity_client.aclose()
+        if self.owns_http_client:
+            await self.http_client.aclose()
+
+    async def search(self, query: str) -> List[str]:
         """Queries Perplexity. Returns a list of URLs (citations from Perplexity)."""
 
-        messages = [
-            {
-                "role": "system",
-                "content": "Be specific and precise. Follow every detail in the query",
-            },
-            {"role": "user", "content": query},
-        ]
+        messages = [PERPLEXITY_SYSTEM_MESSAGE, {"role": "user", "content": query}]
         cache_key = self.perplexity_cache.make_key_for_messages(
             model=self.perplexity_model, messages=messages
         )
@@ -51,13 +180,29 @@ class WebAgent:
             logger.info(f"Perplexity cache hit for query: {query}")
             return cached.citations
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-        response = requests.post(
+        if self.redis_cache is not None:
+            cached = await self.redis_cache.lookup(cache_key)
+            if cached:
+                logger.info(f"Perplexity Redis cache hit for query: {query}")
+                self.perplexity_cache.set(cache_key, cached)
+                return cached.citations
+
+        embedding = None
+        if self.semantic_cache is not None:
+            try:
+                similar_key, embedding = await self.semantic_cache.lookup(
+                    self.perplexity_model, messages
+                )
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {str(e)}")
+                similar_key = None
+            cached = self.perplexity_cache.get(similar_key) if similar_key else None
+            if cached:
+                logger.info(f"Perplexity semantic cache hit for query: {query}")
+                return cached.citations
+
+        response = await self.perplexity_client.post(
             url=self.perplexity_url,
-            headers=headers,
             json={
                 "model": self.perplexity_model,
                 "messages": messages,
@@ -71,9 +216,11 @@ class WebAgent:
                 f"{response.status_code}: {response.text}"
             )
 
-        data = response.json()
+        data = orjson.loads(response.content)
         answer = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        citations = data.get("citations", [])
+        # Drop repeated sources, and share one string per URL between all the
+        # records that cite it
+        citations = [sys.intern(url) for url in unique_urls(data.get("citations", []))]
 
         perplexity_record = PerplexityCallRecord(
             model=self.perplexity_model,
@@ -85,51 +232,102 @@ class WebAgent:
 
         logger.info(f"Setting Perplexity cache for query {query}...")
         self.perplexity_cache.set(cache_key, perplexity_record)
+        if self.semantic_cache is not None and embedding is not None:
+            self.semantic_cache.add(
+                self.perplexity_model,
+                messages,
+                cache_key,
+                embedding,
+                self.perplexity_cache,
+            )
+        if self.redis_cache is not None:
+            await self.redis_cache.update(
+                cache_key, perplexity_record, CACHE_TTLS["search"]
+            )
         logger.info(f"Perplexity cache set for query {query}")
 
         return citations
 
-    def scrape_citations(self, citations: List[str]) -> List[URLScrapeRecord]:
+    async def scrape_citations(self, citations: List[str]) -> List[URLScrapeRecord]:
         """
-        Concurrently scrape each URL from the results.
-        Return a dict: {url -> text_content}
+        Concurrently scrape each unique URL from the results, skipping ones that
+        fail. Returns the scraped records in citation order.
         """
 
-        def fetch(url: str) -> Optional[URLScrapeRecord]:
-            cache_key = self.content_cache.make_key_for_messages(url)
-            cached = self.content_cache.get(cache_key)
+        # Citations often repeat across queries (sometimes as slightly different
+        # links); serve cached pages right away and only fetch the rest
+        urls = unique_urls(citations)
+        records: Dict[str, Optional[URLScrapeRecord]] = {}
+        misses: List[str] = []
+        for url in urls:
+            cached = self.content_cache.get(
+                self.content_cache.make_key_for_messages(url)
+            )
             if cached:
-                return cached
+                records[url] = cached
+            else:
+                misses.append(url)
 
-            try:
-                resp = requests.get(url, timeout=self.scrape_citations_timeout)
-                if resp.status_code == 200:
-                    # Use readability for main content extraction
-                    doc = Document(resp.text)
-                    readable_text = doc.summary()
-
-                    # Clean up the text
-                    soup = BeautifulSoup(readable_text, "html.parser")
-                    clean_text = soup.get_text(separator="\n", strip=True)
-
-                    record = URLScrapeRecord(url=url, content=clean_text)
-                    self.content_cache.set(cache_key, record)
-                    return record
-                else:
-                    print(url, f"Error with URL {url}: status {resp.status_code}")
-                    return None
+        if misses:
+            fetched = await asyncio.gather(*(self._fetch(url) for url in misses))
+            records.update(zip(misses, fetched))
 
-            except Exception as e:
-                print(f"Exception for url {url}: {e}")
-                return None
+        return [records[url] for url in urls if records[url]]
 
-        content: List[URLScrapeRecord] = []
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(fetch, url) for url in citations]
+    async def iter_scrape_citations(
+        self, citations: List[str]
+    ) -> AsyncIterator[URLScrapeRecord]:
+        """
+        Like `scrape_citations`, but yields each page as soon as it's scraped (cached
+        pages first), so callers can start on it while the rest download.
+        """
 
-        for f in as_completed(futures):
-            result = f.result()
-            if result:
-                content.append(result)
+        misses: List[str] = []
+        for url in unique_urls(citations):
+            cached = self.content_cache.get(
+                self.content_cache.make_key_for_messages(url)
+            )
+            if cached:
+                yield cached
+            else:
+                misses.append(url)
+
+        tasks = [asyncio.create_task(self._fetch(url)) for url in misses]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                record = await next_done
+                if record:
+                    yield record
+        finally:
+            # Stop fetching if the caller stopped early
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch(self, url: str) -> Optional[URLScrapeRecord]:
+        """Scrape the main content of a single URL and cache it."""
+
+        try:
+            async with self._scrape_sem:
+                resp = await self.http_client.get(
+                    url,
+                    timeout=self.scrape_citations_timeout,
+                    follow_redirects=True,
+                )
+            if resp.status_code == 200:
+                # Use readability for main content extraction; it's CPU bound, so
+                # keep it off the event loop
+                clean_text = await asyncio.to_thread(extract_readable_text, resp.text)
+                clean_text = truncate_utf8(clean_text, self.max_content_bytes)
+
+                record = URLScrapeRecord(url=url, content=clean_text)
+                self.content_cache.set(
+                    self.content_cache.make_key_for_messages(url), record
+                )
+                return record
+            else:
+                print(url, f"Error with URL {url}: status {resp.status_code}")
+                return None
 
-        return content
+        except Exception as e:
+            print(f"Exception for url {url}: {e}")
+            return None
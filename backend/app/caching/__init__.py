@@ -1,12 +1,19 @@
+from app.caching.breakdown_cache import BreakdownFileCache
 from app.caching.content_cache import ContentFileCache, URLScrapeRecord
 from app.caching.openai_cache import OpenAICallRecord, OpenAIFileCache
 from app.caching.perplexity_cache import PerplexityCallRecord, PerplexityFileCache
+from app.caching.redis_cache import RedisCache, get_shared_redis_cache
+from app.caching.semantic_cache import SemanticCache
 
 __all__ = [
+    "BreakdownFileCache",
     "ContentFileCache",
     "OpenAIFileCache",
     "OpenAICallRecord",
     "PerplexityFileCache",
     "PerplexityCallRecord",
+    "RedisCache",
+    "SemanticCache",
     "URLScrapeRecord",
+    "get_shared_redis_cache",
 ]
@@ -1,82 +1,199 @@
+import atexit
 import fcntl
-import json
 import os
+import queue
+import threading
 import time
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import (
+    Annotated,
+    Any,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    get_args,
+    get_origin,
+)
 
+import orjson
 from pydantic import BaseModel
 
+# Cache files are only written by this app (via `model_dump`), so by default their
+# records are rebuilt with `model_construct` instead of being re-validated. Set
+# CACHE_TRUST_DISK=0 to validate them anyway.
+CACHE_TRUST_DISK = os.getenv("CACHE_TRUST_DISK", "1") != "0"
+
 
 @contextmanager
-def file_lock(lock_path: str, timeout: int = 5):
+def file_lock(lock_fd: int, thread_lock: Optional[threading.Lock] = None):
     """
     File locking context manager using fcntl.
     Works on Linux and OSX.
 
+    The lock file stays open (and on disk) for the lifetime of the cache, so each
+    acquire is a single blocking flock; the OS queues waiters instead of us
+    polling. flock doesn't exclude threads sharing the same open file, so pass a
+    `thread_lock` to also serialize threads within this process.
+
     Args:
-        lock_path: Path to the lock file
-        timeout: Maximum time to wait for lock in seconds
+        lock_fd: File descriptor of the open lock file
+        thread_lock: Optional in-process lock taken around the file lock
     """
-    start_time = time.time()
-    lock_file = None
+    if thread_lock is not None:
+        thread_lock.acquire()
 
     try:
-        while True:
-            try:
-                # Open or create lock file
-                lock_file = open(lock_path, "w")
-
-                # Try to acquire lock without blocking
-                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                break  # Lock acquired
-
-            except BlockingIOError:
-                # Lock not acquired
-                if lock_file:
-                    lock_file.close()
-                    lock_file = None
-
-                if time.time() - start_time > timeout:
-                    raise TimeoutError(
-                        f"Could not acquire lock after {timeout} seconds"
-                    )
-
-                time.sleep(0.1)  # Short sleep before retry
-
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
         try:
             yield
         finally:
-            if lock_file:
-                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
-                lock_file.close()
-
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
     finally:
-        # Clean up lock file
-        try:
-            if lock_file:
-                lock_file.close()
-            if os.path.exists(lock_path):
-                os.unlink(lock_path)
-        except OSError:
-            pass
+        if thread_lock is not None:
+            thread_lock.release()
+
+
+def _construct_annotated(annotation: Any, value: Any) -> Any:
+    """Rebuild `value` for a field annotation, recursing into nested models."""
+    if value is None:
+        return None
+
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return (
+            _construct_trusted(annotation, value) if isinstance(value, dict) else value
+        )
+
+    origin = get_origin(annotation)
+    args = get_args(annotation)
+    if origin is Annotated:
+        return _construct_annotated(args[0], value)
+    elif origin is Union:
+        # Optional[Model] and friends: use the first model type in the union whose
+        # Literal fields (the discriminator of a tagged union) match the value
+        models = [a for a in args if isinstance(a, type) and issubclass(a, BaseModel)]
+        for model in models:
+            if _matches_literals(model, value):
+                return _construct_annotated(model, value)
+        if models:
+            return _construct_annotated(models[0], value)
+    elif origin in (list, tuple, set) and args and isinstance(value, list):
+        return origin(_construct_annotated(args[0], v) for v in value)
+    elif origin is dict and len(args) == 2 and isinstance(value, dict):
+        return {k: _construct_annotated(args[1], v) for k, v in value.items()}
+
+    return value
+
+
+def _matches_literals(cls: Type[BaseModel], value: Any) -> bool:
+    """Whether the dumped `value` has an allowed value for each Literal field."""
+    if not isinstance(value, dict):
+        return True
+    return all(
+        value.get(name) in get_args(field.annotation)
+        for name, field in cls.model_fields.items()
+        if get_origin(field.annotation) is Literal
+    )
+
+
+def _construct_trusted(cls: Type[BaseModel], data: Dict[str, Any]) -> BaseModel:
+    """
+    Build a `cls` instance from its `model_dump()` output without validation.
+    Only use this for data this app wrote itself.
+    """
+    return cls.model_construct(
+        **{
+            name: _construct_annotated(field.annotation, data[name])
+            for name, field in cls.model_fields.items()
+            if name in data
+        }
+    )
 
 
 class FileCache:
-    """Thread-safe JSON file-based cache for storing data."""
+    """
+    Thread-safe file-based cache for storing data.
+
+    The cache file is an append-only JSON Lines log: every `set` appends a single
+    `{"k": key, "v": value}` record, and when a key is written more than once the
+    latest record wins. The log is compacted once it holds many stale records.
+    A plain JSON cache file from before the log format is migrated on first load.
+
+    `set` updates memory and returns immediately; a background writer thread
+    appends queued records in batches, taking the file lock once per batch. Call
+    `flush` to wait until everything set so far is on disk.
+
+    The cache files are trusted because only this app writes them, so records are
+    loaded without validation (see `CACHE_TRUST_DISK`). Data from anywhere else
+    must go through `import_external`, which validates every record.
+
+    All caches for the same file share one state: constructing a cache for a file
+    that is already open reuses the open cache's entries, writer and lock, so the
+    file is loaded once per process and every user sees every other user's writes.
+    """
+
+    # Compact the log once it holds this many records per live key
+    COMPACTION_RATIO = 4
+    # ...but never bother compacting logs smaller than this
+    MIN_COMPACTION_RECORDS = 1000
+    # How long the writer thread keeps collecting records before a write
+    WRITE_BATCH_DELAY = 0.05
+
+    # State of every open cache, by resolved file path
+    _open_caches: Dict[Path, Dict[str, Any]] = {}
+    _open_caches_lock = threading.Lock()
 
     def __init__(self, cache_file: str, value_format: BaseModel):
+        # Caches for a file that is already open share the open cache's state
+        path = Path(cache_file).resolve()
+        with FileCache._open_caches_lock:
+            state = FileCache._open_caches.get(path)
+            if state is None:
+                FileCache._open_caches[path] = self.__dict__
+        if state is not None:
+            if state["value_format"] is not value_format:
+                raise ValueError(
+                    f"{path} is already open for {state['value_format'].__name__}"
+                )
+            self.__dict__ = state
+            return
+
         self.cache_file = Path(cache_file)
         self.value_format = value_format
         self.cache_data: Dict[str, BaseModel] = dict()
+        # Encoded log line of each entry, so compaction never re-dumps a value
+        self._serialized: Dict[str, bytes] = dict()
+
+        # Number of records in the log file, including stale ones
+        self._log_records = 0
 
         # Create lock file path
         self.lock_path = str(self.cache_file) + ".lock"
 
         self._ensure_cache_dir()
+
+        # Keep the lock file open for the lifetime of the cache
+        self._lock_fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        self._thread_lock = threading.Lock()
+        atexit.register(os.close, self._lock_fd)
+
+        # Keys waiting to be appended by the writer thread (started on first set)
+        self._write_queue: "queue.Queue[str]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        # Registered after the fd close, so it runs before it at exit
+        atexit.register(self.flush)
+
         self._load_cache()
 
+    @property
+    def legacy_cache_file(self) -> Path:
+        """Where this cache lived before the log format (`x.jsonl` -> `x.json`)."""
+        return self.cache_file.with_suffix(".json")
+
     def _ensure_cache_dir(self):
         """Ensure cache directory exists."""
         self.cache_file.parent.mkdir(parents=True, exist_ok=True)
@@ -84,45 +201,321 @@ class FileCache:
     def _load_cache(self):
         """Load cache data with file locking."""
         if not self.cache_file.is_file():
+            if self.legacy_cache_file != self.cache_file:
+                self._migrate_legacy_cache()
             return
 
-        with file_lock(self.lock_path):
+        with file_lock(self._lock_fd, self._thread_lock):
             try:
-                with open(self.cache_file, "r") as f:
-                    json_cache: Dict[str, Dict[str, Any]] = json.load(f)
+                (
+                    self.cache_data,
+                    self._serialized,
+                    self._log_records,
+                    intact,
+                ) = self._read_log()
+                if not intact:
+                    # Drop torn records so later appends start on a clean line
+                    self._write_compacted()
+            except Exception as e:
+                print(f"Error loading cache: {str(e)}")
+                self.cache_data = dict()
+                self._serialized = dict()
+                self._log_records = 0
+
+    def _read_log(
+        self,
+    ) -> Tuple[Dict[str, BaseModel], Dict[str, bytes], int, bool]:
+        """
+        Replay the log. Must be called with the file lock held.
+        Returns the entries, their encoded lines, the number of records in the log,
+        and False if any torn records had to be skipped.
+        """
+        cache_data: Dict[str, BaseModel] = dict()
+        serialized: Dict[str, bytes] = dict()
+        log_records = 0
+        intact = True
+
+        with open(self.cache_file, "rb") as f:
+            for line in f:
+                try:
+                    record: Dict[str, Any] = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Torn write from a crash mid-append; skip it
+                    intact = False
+                    continue
+
+                cache_data[record["k"]] = self._load_value(record["v"])
+                # The line is already the encoded record; keep it for compaction
+                serialized[record["k"]] = line if line.endswith(b"\n") else line + b"\n"
+                log_records += 1
+
+        return cache_data, serialized, log_records, intact
+
+    def _migrate_legacy_cache(self):
+        """One-shot import of a cache written as a single JSON object."""
+        if not self.legacy_cache_file.is_file():
+            return
+
+        with file_lock(self._lock_fd, self._thread_lock):
+            try:
+                with open(self.legacy_cache_file, "rb") as f:
+                    json_cache: Dict[str, Dict[str, Any]] = orjson.loads(f.read())
                     self.cache_data = {
-                        k: self.value_format.model_validate(v)
-                        for k, v in json_cache.items()
+                        k: self._load_value(v) for k, v in json_cache.items()
                     }
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 self.cache_data = dict()
+                return
             except Exception as e:
-                print(f"Error loading cache: {str(e)}")
+                print(f"Error migrating cache: {str(e)}")
                 self.cache_data = dict()
+                return
+
+            self._write_compacted()
+
+    def _load_value(self, data: Dict[str, Any]) -> BaseModel:
+        """Rebuild a value read back from this cache's own files."""
+        if CACHE_TRUST_DISK:
+            return _construct_trusted(self.value_format, data)
+        return self.value_format.model_validate(data)
+
+    def import_external(self, path: str) -> int:
+        """
+        Validate and import records from a cache file this app didn't write, e.g.
+        one copied from another machine. Accepts both the JSONL log format and the
+        legacy single JSON object format. Returns the number of imported records.
+        """
+        with open(path, "rb") as f:
+            text = f.read()
+
+        try:
+            legacy_cache = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            legacy_cache = None
+
+        if isinstance(legacy_cache, dict) and "k" not in legacy_cache:
+            records = list(legacy_cache.items())
+        else:
+            records = []
+            for line in text.splitlines():
+                if line.strip():
+                    record = orjson.loads(line)
+                    records.append((record["k"], record["v"]))
+
+        imported = {k: self.value_format.model_validate(v) for k, v in records}
+        self._set_many(imported)
+
+        return len(imported)
+
+    def _set_many(self, entries: Dict[str, BaseModel]) -> None:
+        """Store many entries at once, writing them with a single compaction."""
+        with file_lock(self._lock_fd, self._thread_lock):
+            self.cache_data.update(entries)
+            for k in entries:
+                self._serialized.pop(k, None)
+            self._compact()
 
     def get(self, key: str) -> Optional[BaseModel]:
         """Thread-safe get operation."""
         return self.cache_data.get(key)
 
     def set(self, key: str, value: BaseModel) -> None:
-        """Thread-safe set operation."""
+        """Thread-safe set operation. The write to disk happens in the background."""
         # Update in-memory data
+        self._serialized[key] = self._encode_record(key, value)
         self.cache_data[key] = value
 
-        # Write to file with lock
-        with file_lock(self.lock_path):
+        # Hand the write to the writer thread
+        self._ensure_writer()
+        self._write_queue.put(key)
+
+    def flush(self) -> None:
+        """Block until every record set so far has been written to disk."""
+        if self._writer is not None:
+            self._write_queue.join()
+
+    def close(self) -> None:
+        """
+        Write out everything set so far, then release the cache's entries. A cache
+        for the same file constructed afterwards loads it again from disk.
+        """
+        self.flush()
+        with FileCache._open_caches_lock:
+            path = self.cache_file.resolve()
+            if FileCache._open_caches.get(path) is self.__dict__:
+                del FileCache._open_caches[path]
+        self.cache_data = dict()
+        self._serialized = dict()
+
+    def _ensure_writer(self) -> None:
+        if self._writer is None:
+            with self._thread_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._write_loop,
+                        name=f"cache-writer:{self.cache_file.name}",
+                        daemon=True,
+                    )
+                    self._writer.start()
+
+    def _write_loop(self) -> None:
+        """Writer thread: append queued records in batches."""
+        while True:
+            batch: List[str] = [self._write_queue.get()]
+
+            # Coalesce whatever else arrives shortly after into the same write
+            deadline = time.monotonic() + self.WRITE_BATCH_DELAY
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self._write_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
             try:
-                with open(self.cache_file, "w") as f:
-                    json_cache: Dict[str, Dict[str, Any]] = {
-                        k: v.model_dump() for k, v in self.cache_data.items()
-                    }
-                    json.dump(json_cache, f, indent=4)
+                self._append(list(dict.fromkeys(batch)))
             except Exception as e:
                 print(f"Error saving to cache: {str(e)}")
-                # Remove from memory if we couldn't save
-                if key in self.cache_data:
-                    del self.cache_data[key]
-                raise
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+
+    def _append(self, keys: List[str]) -> None:
+        """Append the latest records of `keys` to the log with a single fsync."""
+        with file_lock(self._lock_fd, self._thread_lock):
+            with open(self.cache_file, "ab") as f:
+                f.write(b"".join(self._serialized[key] for key in keys))
+                f.flush()
+                os.fsync(f.fileno())
+            self._log_records += len(keys)
+
+            if self._needs_compaction():
+                self._compact()
+
+    @staticmethod
+    def _encode_record(key: str, value: BaseModel) -> bytes:
+        """Serialize one log line, newline included."""
+        try:
+            return orjson.dumps(
+                {"k": key, "v": value.model_dump()}, option=orjson.OPT_APPEND_NEWLINE
+            )
+        except orjson.JSONEncodeError:
+            # Values orjson can't handle natively (e.g. non-str dict keys) still
+            # serialize through pydantic
+            return b'{"k":%s,"v":%s}\n' % (
+                orjson.dumps(key),
+                value.model_dump_json().encode("utf-8"),
+            )
+
+    def _needs_compaction(self) -> bool:
+        return (
+            self._log_records >= self.MIN_COMPACTION_RECORDS
+            and self._log_records > self.COMPACTION_RATIO * len(self.cache_data)
+        )
+
+    def _compact(self):
+        """
+        Rewrite the log with only the latest record per key. Must be called with
+        the file lock held.
+        """
+        # Pick up records appended by other processes before dropping the log
+        if self.cache_file.is_file():
+            disk_data, disk_serialized, _, _ = self._read_log()
+            for k, v in disk_data.items():
+                if k not in self.cache_data:
+                    self._serialized[k] = disk_serialized[k]
+                    self.cache_data[k] = v
+
+        self._write_compacted()
+
+    def _write_compacted(self):
+        """Atomically replace the log with one record per key."""
+        tmp_file = str(self.cache_file) + ".tmp"
+        with open(tmp_file, "wb") as f:
+            # Snapshot the items; `set` may add entries from other threads
+            for k, v in list(self.cache_data.items()):
+                if k not in self._serialized:
+                    self._serialized[k] = self._encode_record(k, v)
+                f.write(self._serialized[k])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.cache_file)
+
+        self._log_records = len(self.cache_data)
+
+    def make_key_for_messages(self, messages: list) -> str:
+        """Generate cache key from messages. Must be implemented by subclasses."""
+        raise NotImplementedError("Subclasses must implement this method")
+
+
+class ShardedFileCache:
+    """
+    A `FileCache` split into `num_shards` independent files by key hash, so
+    writers to different shards never contend on the same lock or file.
+
+    Shard files are named after `cache_file` with a hex shard suffix, e.g.
+    `content_cache_00.jsonl` ... `content_cache_0f.jsonl`. Keys must be hex
+    digests (all our cache keys are sha256 hex). An existing unsharded cache at
+    `cache_file` is split into the shards on first load.
+    """
+
+    def __init__(self, cache_file: str, value_format: BaseModel, num_shards: int = 16):
+        assert (
+            num_shards > 0 and num_shards & (num_shards - 1) == 0
+        ), "num_shards must be a power of two"
+
+        self.cache_file = Path(cache_file)
+        self.value_format = value_format
+        self.num_shards = num_shards
+
+        self.shard_files: List[Path] = [
+            self.cache_file.with_name(
+                f"{self.cache_file.stem}_{i:02x}{self.cache_file.suffix}"
+            )
+            for i in range(num_shards)
+        ]
+        needs_migration = not any(path.is_file() for path in self.shard_files)
+
+        self.shards: List[FileCache] = [
+            FileCache(str(path), value_format) for path in self.shard_files
+        ]
+
+        if needs_migration:
+            self._migrate_unsharded_cache()
+
+    def _shard_index(self, key: str) -> int:
+        # Keys are hex digests, so their low bits are uniformly distributed
+        return int(key[-8:], 16) & (self.num_shards - 1)
+
+    def _migrate_unsharded_cache(self):
+        """One-shot split of an unsharded cache (or its legacy JSON) into shards."""
+        if not (
+            self.cache_file.is_file() or self.cache_file.with_suffix(".json").is_file()
+        ):
+            return
+
+        unsharded = FileCache(str(self.cache_file), self.value_format)
+        by_shard: Dict[int, Dict[str, BaseModel]] = {}
+        for k, v in unsharded.cache_data.items():
+            by_shard.setdefault(self._shard_index(k), {})[k] = v
+
+        for i, entries in by_shard.items():
+            self.shards[i]._set_many(entries)
+
+        # The shards hold the entries now; don't keep a second copy open
+        unsharded.close()
+
+    def get(self, key: str) -> Optional[BaseModel]:
+        """Thread-safe get operation."""
+        return self.shards[self._shard_index(key)].get(key)
+
+    def set(self, key: str, value: BaseModel) -> None:
+        """Thread-safe set operation. The write to disk happens in the background."""
+        self.shards[self._shard_index(key)].set(key, value)
+
+    def flush(self) -> None:
+        """Block until every record set so far has been written to disk."""
+        for shard in self.shards:
+            shard.flush()
 
     def make_key_for_messages(self, messages: list) -> str:
         """Generate cache key from messages. Must be implemented by subclasses."""
@@ -0,0 +1,36 @@
+from hashlib import sha256
+from typing import List, Optional
+
+from app.caching.base import FileCache
+from app.models.tree import BreakdownAttempt
+
+
+class BreakdownFileCache(FileCache):
+    """
+    Breakdown attempts whose searches all came up empty, so the same breakdown
+    isn't planned and searched again. Make sure to store `BreakdownAttempt` objects
+    in the cache.
+    """
+
+    def __init__(self, cache_file: str = "failed_breakdown_cache.jsonl"):
+        super().__init__(cache_file, BreakdownAttempt)
+
+    def get(self, key: str) -> Optional[BreakdownAttempt]:
+        return super().get(key)
+
+    def set(self, key: str, value: BreakdownAttempt) -> None:
+        super().set(key, value)
+
+    def make_key_for_messages(
+        self, question: str, failed_searches: List[str], prompt_fingerprint: str = ""
+    ) -> str:
+        """
+        Combine the question with the searches that failed for it, then hash it.
+        `prompt_fingerprint` identifies the prompts the breakdown was planned with.
+        """
+
+        hasher = sha256(f"{prompt_fingerprint}||{question}||".encode("utf-8"))
+        for search in failed_searches:
+            hasher.update(f"{search}||".encode("utf-8"))
+
+        return hasher.hexdigest()
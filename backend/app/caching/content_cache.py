@@ -1,15 +1,15 @@
 from hashlib import sha256
 from typing import Optional
 
-from app.caching.base import FileCache
+from app.caching.base import ShardedFileCache
 from app.models.cache import URLScrapeRecord
 
 
-class ContentFileCache(FileCache):
+class ContentFileCache(ShardedFileCache):
     """Make sure to store `URLScrapeRecord` objects in the cache."""
 
-    def __init__(self, cache_file: str = "content_cache.json"):
-        super().__init__(cache_file, URLScrapeRecord)
+    def __init__(self, cache_file: str = "content_cache.jsonl", num_shards: int = 16):
+        super().__init__(cache_file, URLScrapeRecord, num_shards=num_shards)
 
     def get(self, key: str) -> Optional[URLScrapeRecord]:
         return super().get(key)
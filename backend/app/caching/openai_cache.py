@@ -8,7 +8,7 @@ from app.models.cache import OpenAICallRecord
 class OpenAIFileCache(FileCache):
     """Make sure to store `OpenAICallRecord` objects in the cache."""
 
-    def __init__(self, cache_file: str = "openai_cache.json"):
+    def __init__(self, cache_file: str = "openai_cache.jsonl"):
         super().__init__(cache_file, OpenAICallRecord)
 
     def get(self, key: str) -> Optional[OpenAICallRecord]:
@@ -18,14 +18,29 @@ class OpenAIFileCache(FileCache):
         super().set(key, value)
 
     def make_key_for_messages(
-        self, engine_name: str, messages: List[Dict[str, str]]
+        self,
+        engine_name: str,
+        messages: List[Dict[str, str]],
+        normalize: bool = True,
     ) -> str:
         """
         Combine role + content from message chain, then hash it.
+
+        With `normalize`, whitespace in the contents is collapsed first, so prompts
+        that only differ in spacing or line breaks share a key. Keys made without it
+        are the ones older cache files were written with.
         """
 
-        combined = f"{engine_name}||"
+        # Feed the hasher piece by piece instead of building one big string; the
+        # bytes (and so the keys) are the same as hashing the concatenation
+        hasher = sha256(f"{engine_name}||".encode("utf-8"))
         for msg in messages:
-            combined += f"{msg['role']}:{msg['content']}||"
+            content = normalize_content(msg["content"]) if normalize else msg["content"]
+            hasher.update(f"{msg['role']}:{content}||".encode("utf-8"))
+
+        return hasher.hexdigest()
+
 
-        return sha256(combined.encode("utf-8")).hexdigest()
+def normalize_content(content: str) -> str:
+    """Strip a message's content and collapse each run of whitespace to a space."""
+    return " ".join(content.split())
@@ -8,7 +8,7 @@ from app.models.cache import PerplexityCallRecord
 class PerplexityFileCache(FileCache):
     """Make sure to store `PerplexityCallRecord` objects in the cache."""
 
-    def __init__(self, cache_file: str = "perplexity_cache.json"):
+    def __init__(self, cache_file: str = "perplexity_cache.jsonl"):
         super().__init__(cache_file, PerplexityCallRecord)
 
     def get(self, key: str) -> PerplexityCallRecord:
@@ -22,8 +22,10 @@ class PerplexityFileCache(FileCache):
         Combine role + content from message chain, then hash it.
         """
 
-        combined = f"{model}||"
+        # Feed the hasher piece by piece instead of building one big string; the
+        # bytes (and so the keys) are the same as hashing the concatenation
+        hasher = sha256(f"{model}||".encode("utf-8"))
         for msg in messages:
-            combined += f"{msg['role']}:{msg['content']}||"
+            hasher.update(f"{msg['role']}:{msg['content']}||".encode("utf-8"))
 
-        return sha256(combined.encode("utf-8")).hexdigest()
+        return hasher.hexdigest()
@@ -0,0 +1,75 @@
+import logging
+import os
+from functools import lru_cache
+from typing import Optional, Type
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Setting this turns on the Redis cache, shared by every worker process
+REDIS_URL = os.getenv("REDIS_URL")
+
+# How long cached responses live in Redis, in seconds, by kind of call
+CACHE_TTLS = {
+    "generation": 3600,
+    "search": 86400,
+}
+
+
+class RedisCache:
+    """
+    Cache of API call records in Redis, with a TTL on every entry. Unlike the file
+    caches it is shared by all worker processes, so a response one worker got is a
+    hit for the others.
+
+    Requires the `redis` package (only imported when the cache is created).
+    """
+
+    def __init__(self, url: str, value_format: Type[BaseModel], prefix: str):
+        """
+        Args:
+            url: Redis URL, e.g. redis://localhost:6379/0
+            value_format: Type of the cached records
+            prefix: Prepended to every key, so different record types can't collide
+        """
+
+        import redis.asyncio as redis
+
+        self.client = redis.Redis.from_url(url)
+        self.value_format = value_format
+        self.prefix = prefix
+
+    async def lookup(self, key: str) -> Optional[BaseModel]:
+        """The record cached under `key`, or None on a miss or a Redis error."""
+
+        try:
+            payload = await self.client.get(f"{self.prefix}:{key}")
+        except Exception as e:
+            logger.warning(f"Redis cache lookup failed: {str(e)}")
+            return None
+
+        if payload is None:
+            return None
+        return self.value_format.model_validate_json(payload)
+
+    async def update(self, key: str, value: BaseModel, ttl: int) -> None:
+        """Cache `value` under `key` for `ttl` seconds. Redis errors are logged."""
+
+        try:
+            await self.client.setex(
+                f"{self.prefix}:{key}", ttl, value.model_dump_json()
+            )
+        except Exception as e:
+            logger.warning(f"Redis cache update failed: {str(e)}")
+
+
+@lru_cache(maxsize=None)
+def get_shared_redis_cache(
+    value_format: Type[BaseModel], prefix: str
+) -> Optional[RedisCache]:
+    """The process-wide Redis cache for a record type, or None if it isn't turned on."""
+
+    if not REDIS_URL:
+        return None
+    return RedisCache(REDIS_URL, value_format, prefix)
@@ -0,0 +1,156 @@
+import math
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.caching.base import FileCache
+from app.models.cache import PromptEmbeddingRecord
+from openai import AsyncOpenAI
+
+
+class SemanticCache:
+    """
+    In-memory index from prompt embeddings to cache keys, used to find a cached call
+    whose prompt is a near-duplicate (e.g. a reworded question) of a new one.
+
+    Only the last message of a chain is embedded; the model and the earlier messages
+    (the system prompt) must match exactly. Lookups scan every entry with the same
+    model and system prompt, which is fine for the number of calls one process makes.
+
+    Prompt embeddings are kept in a sidecar cache file next to each indexed cache
+    file (`x.jsonl` -> `x_embeddings.jsonl`), so `index_cache` can rebuild the index
+    when a new process starts without the records themselves carrying embeddings.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.97,
+        embedding_model: str = "text-embedding-3-small",
+        client: Optional[AsyncOpenAI] = None,
+        max_cached_embeddings: int = 4096,
+    ):
+        """
+        Args:
+            threshold: Minimum cosine similarity for two prompts to count as the same
+            embedding_model: OpenAI model used to embed prompts
+            client: Client used for the embedding calls (a new one by default)
+            max_cached_embeddings: How many recent prompt embeddings to keep, so a
+                replayed prompt isn't embedded again
+        """
+
+        self.threshold = threshold
+        self.embedding_model = embedding_model
+        self.client = client or AsyncOpenAI()
+
+        # namespace -> [(unit-length embedding, cache key)]
+        self._entries: Dict[str, List[Tuple[List[float], str]]] = {}
+        # Most recently embedded texts, least recent first
+        self.max_cached_embeddings = max_cached_embeddings
+        self._embeddings: OrderedDict[str, List[float]] = OrderedDict()
+        # Cache files already indexed by `index_cache`, and their embedding sidecars
+        self._indexed_files: Set[Path] = set()
+        self._sidecars: Dict[Path, FileCache] = {}
+
+    async def lookup(
+        self, model: str, messages: List[Dict[str, str]]
+    ) -> Tuple[Optional[str], List[float]]:
+        """
+        Find the most similar indexed prompt above the threshold.
+
+        Returns:
+            Tuple of:
+            - Its cache key (None if there is none)
+            - The prompt's embedding, to pass to `add` once its result is cached
+        """
+
+        embedding = await self._embed(messages[-1]["content"])
+
+        best_key, best_similarity = None, self.threshold
+        for other, key in self._entries.get(self._namespace(model, messages), []):
+            similarity = sum(a * b for a, b in zip(embedding, other))
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+
+        return best_key, embedding
+
+    def add(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        key: str,
+        embedding: List[float],
+        cache: Optional[FileCache] = None,
+    ) -> None:
+        """
+        Index the prompt of a call whose result was cached under `key`. If `cache`
+        is the cache the result went into, the embedding is also saved to its sidecar.
+        """
+
+        namespace = self._namespace(model, messages)
+        self._entries.setdefault(namespace, []).append((embedding, key))
+        if cache is not None:
+            self._sidecar(cache).set(
+                key, PromptEmbeddingRecord(namespace=namespace, embedding=embedding)
+            )
+
+    def index_cache(self, cache: FileCache) -> int:
+        """
+        Index every record in `cache` whose prompt embedding is in its sidecar. Each
+        cache file is only indexed once.
+
+        Returns:
+            Number of records indexed
+        """
+
+        if cache.cache_file in self._indexed_files:
+            return 0
+        self._indexed_files.add(cache.cache_file)
+
+        indexed = 0
+        for key, record in list(self._sidecar(cache).cache_data.items()):
+            if cache.get(key) is not None:
+                self._entries.setdefault(record.namespace, []).append(
+                    (record.embedding, key)
+                )
+                indexed += 1
+        return indexed
+
+    def _sidecar(self, cache: FileCache) -> FileCache:
+        """The file cache holding the prompt embeddings of `cache`'s records."""
+
+        sidecar = self._sidecars.get(cache.cache_file)
+        if sidecar is None:
+            sidecar = FileCache(
+                str(
+                    cache.cache_file.with_name(
+                        f"{cache.cache_file.stem}_embeddings{cache.cache_file.suffix}"
+                    )
+                ),
+                PromptEmbeddingRecord,
+            )
+            self._sidecars[cache.cache_file] = sidecar
+        return sidecar
+
+    async def _embed(self, text: str) -> List[float]:
+        if text in self._embeddings:
+            self._embeddings.move_to_end(text)
+            return self._embeddings[text]
+
+        response = await self.client.embeddings.create(
+            model=self.embedding_model, input=text
+        )
+        embedding = response.data[0].embedding
+        norm = math.sqrt(sum(x * x for x in embedding)) or 1.0
+        embedding = [x / norm for x in embedding]
+
+        self._embeddings[text] = embedding
+        if len(self._embeddings) > self.max_cached_embeddings:
+            self._embeddings.popitem(last=False)
+        return embedding
+
+    def _namespace(self, model: str, messages: List[Dict[str, str]]) -> str:
+        hasher = sha256(f"{model}||".encode("utf-8"))
+        for msg in messages[:-1]:
+            hasher.update(f"{msg['role']}:{msg['content']}||".encode("utf-8"))
+        return hasher.hexdigest()
@@ -1,14 +1,16 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Callable, Dict, List, Set
+from typing import Callable, Dict, List, Optional, Set
 
 from app.llm.ensemble import ReasoningLlmEnsembler
 from app.models.tree import (
+    CalculateNodeSpec,
     InfoNodeSpec,
     InitialInfoGraph,
     InitialInfoGraphWithGoal,
     ProcessingNode,
 )
-from app.prompts import PROMPTS
+from app.prompts import PROMPTS, PromptTemplate
 
 
 class GraphGenerator(ABC):
@@ -17,16 +19,28 @@ class GraphGenerator(ABC):
     Best to use the ReasoningLlmEnsembler for this.
     """
 
-    def __init__(self, model_dict: Dict[str, List[str]], prompt_name: str):
-        """Initialize with model configuration."""
+    def __init__(
+        self,
+        model_dict: Dict[str, List[str]],
+        prompt_name: str,
+        parallel_providers: bool = True,
+    ):
+        """
+        Initialize with model configuration.
+
+        With `parallel_providers`, each provider's models run concurrently with the
+        other providers' (instead of after them), so providers don't see each
+        other's nodes while generating.
+        """
 
         self.model_dict = model_dict
+        self.parallel_providers = parallel_providers
 
         self.system_prompt = PROMPTS["system"][prompt_name]
-        self.user_prompt = PROMPTS["user"][prompt_name]
+        self.user_prompt = PromptTemplate(PROMPTS["user"][prompt_name])
 
     @abstractmethod
-    def generate_graph(self, *args, **kwargs) -> InitialInfoGraphWithGoal:
+    async def generate_graph(self, *args, **kwargs) -> InitialInfoGraphWithGoal:
         """
         Generate a graph. Must be implemented by subclasses.
 
@@ -90,7 +104,7 @@ class GraphGenerator(ABC):
             assert node.calculation_explanation, "Calculate node must have explanation"
             assert node.input_node_ids, "Calculate node must have input nodes"
 
-    def _generate_sequential_graphs(
+    async def _generate_sequential_graphs(
         self, messages_func: Callable, *args, **kwargs
     ) -> InitialInfoGraphWithGoal:
         """
@@ -107,53 +121,152 @@ class GraphGenerator(ABC):
         if not kwargs.get("goal"):
             raise ValueError("Goal is required for graph generation.")
 
-        # Convert explored nodes from ProcessingNode to InfoNodeSpec
-        # TODO: fairly sure I can do this with fewer conversions
-        processed_nodes: List[ProcessingNode] = kwargs.pop("explored_nodes", [])
-        all_nodes: List[InfoNodeSpec] = self._convert_processed_nodes(processed_nodes)
-
-        # Process each provider
-        # Each provider/model pair will handle a different part of the exploration
-        for provider, models in self.model_dict.items():
-            # Process each model
-            for model in models:
-                # For the graphs we're generating (key info and exploration), we're
-                # looking to get a set of very useful and comprehensive directions
-                # forward; we should use the best models to do this.
-                llm_ensembler = ReasoningLlmEnsembler(
-                    model_dict={provider: [model]}, response_format=InitialInfoGraph
+        # Explored nodes are kept in both forms: the InfoNodeSpecs make up the final
+        # graph, the ProcessingNodes feed messages_func
+        explored_nodes: List[ProcessingNode] = list(kwargs.pop("explored_nodes", []))
+        all_nodes: List[InfoNodeSpec] = self._convert_processed_nodes(explored_nodes)
+
+        if self.parallel_providers and len(self.model_dict) > 1:
+            # Providers run concurrently, each building on the explored nodes only;
+            # their nodes are added in model_dict order so the result is stable
+            # Fail fast: the first provider to raise cancels the others
+            tasks = [
+                asyncio.create_task(
+                    self._generate_provider_nodes(
+                        provider,
+                        models,
+                        list(explored_nodes),
+                        messages_func,
+                        *args,
+                        **kwargs,
+                    )
+                )
+                for provider, models in self.model_dict.items()
+            ]
+            try:
+                provider_results = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+            taken_ids = {node.id for node in all_nodes}
+            for provider, nodes in zip(self.model_dict.keys(), provider_results):
+                provider_nodes = self._namespace_node_ids(
+                    nodes, taken_ids, prefix=provider.lower()
                 )
+                taken_ids.update(node.id for node in provider_nodes)
+                all_nodes.extend(provider_nodes)
+        else:
+            # Each provider/model pair builds on everything generated before it
+            processing_nodes = list(explored_nodes)
+            for provider, models in self.model_dict.items():
+                all_nodes.extend(
+                    await self._generate_provider_nodes(
+                        provider,
+                        models,
+                        processing_nodes,
+                        messages_func,
+                        *args,
+                        **kwargs,
+                    )
+                )
+
+        # Create final graph and validate it
+        complete_graph = InitialInfoGraph(nodes=all_nodes)
+        self._validate_graph(complete_graph)
+
+        return InitialInfoGraphWithGoal(goal=kwargs.get("goal"), graph=complete_graph)
 
-                # Convert InfoNodeSpec back to ProcessingNode for messages_func
-                processing_nodes = self._convert_info_nodes(all_nodes)
+    async def _generate_provider_nodes(
+        self,
+        provider: str,
+        models: List[str],
+        processing_nodes: List[ProcessingNode],
+        messages_func: Callable,
+        *args,
+        **kwargs,
+    ) -> List[InfoNodeSpec]:
+        """
+        Run a provider's models one after another, each exploring new directions
+        given the nodes before it. `processing_nodes` is extended in place with the
+        generated nodes, which are also returned.
+        """
 
-                # Get messages for this model (may depend on previous results)
+        new_nodes: List[InfoNodeSpec] = []
+
+        # The messages only depend on the explored nodes, so they're rebuilt only
+        # when a model added new ones
+        messages = None
+        messages_node_count = -1
+
+        # Process each model
+        for model in models:
+            # For the graphs we're generating (key info and exploration), we're
+            # looking to get a set of very useful and comprehensive directions
+            # forward; we should use the best models to do this.
+            llm_ensembler = ReasoningLlmEnsembler(
+                model_dict={provider: [model]}, response_format=InitialInfoGraph
+            )
+
+            # Get messages for this model (may depend on previous results)
+            if messages_node_count != len(processing_nodes):
                 messages = messages_func(
                     explored_nodes=processing_nodes, *args, **kwargs
                 )
+                messages_node_count = len(processing_nodes)
 
-                # Generate graph from this model
-                model_response = llm_ensembler.call_providers(messages)
+            # Generate graph from this model
+            model_response = await llm_ensembler.call_providers(messages)
 
-                # Get the graph
-                provider_graphs = list(model_response.values())
-                if not provider_graphs:
-                    continue
+            # Get the graph
+            model_graphs = next(iter(model_response.values()), None)
+            if not model_graphs:
+                continue
 
-                model_graphs = provider_graphs[0]
-                if not model_graphs:
-                    continue
+            graph = model_graphs[0]
 
-                graph = model_graphs[0]
+            # Add nodes
+            new_nodes.extend(graph.nodes)
+            processing_nodes.extend(self._convert_info_nodes(graph.nodes))
 
-                # Add nodes
-                all_nodes.extend(graph.nodes)
+        return new_nodes
 
-        # Create final graph and validate it
-        complete_graph = InitialInfoGraph(nodes=all_nodes)
-        self._validate_graph(complete_graph)
+    def _namespace_node_ids(
+        self, nodes: List[InfoNodeSpec], taken_ids: Set[str], prefix: str
+    ) -> List[InfoNodeSpec]:
+        """
+        Rename nodes whose IDs are already taken (providers generating in parallel
+        all number their nodes "node_{i}"), updating references between `nodes` to
+        match.
+        """
 
-        return InitialInfoGraphWithGoal(goal=kwargs.get("goal"), graph=complete_graph)
+        renamed: Dict[str, str] = {}
+        for node in nodes:
+            if node.id in taken_ids:
+                new_id = f"{prefix}_{node.id}"
+                suffix = 1
+                while new_id in taken_ids or new_id in renamed.values():
+                    suffix += 1
+                    new_id = f"{prefix}{suffix}_{node.id}"
+                renamed[node.id] = new_id
+
+        if not renamed:
+            return nodes
+
+        def remap(ids: Optional[List[str]]) -> Optional[List[str]]:
+            return None if ids is None else [renamed.get(i, i) for i in ids]
+
+        def rename(node: InfoNodeSpec) -> InfoNodeSpec:
+            update = {
+                "id": renamed.get(node.id, node.id),
+                "depends_on_ids": remap(node.depends_on_ids),
+            }
+            if isinstance(node, CalculateNodeSpec):
+                update["input_node_ids"] = remap(node.input_node_ids)
+            return node.model_copy(update=update)
+
+        return [rename(node) for node in nodes]
 
     def _convert_processed_nodes(
         self, processed_nodes: List[ProcessingNode]
@@ -168,21 +281,7 @@ class GraphGenerator(ABC):
             List of InfoNodeSpec
         """
 
-        return [
-            InfoNodeSpec(
-                id=node.id,
-                question=node.question,
-                rationale=node.rationale,
-                node_type=node.node_type,
-                depends_on_ids=node.depends_on_ids,
-                gathering_method=node.gathering_method,
-                search_queries=node.search_queries,
-                calculation_code=node.calculation_code,
-                calculation_explanation=node.calculation_explanation,
-                input_node_ids=node.input_node_ids,
-            )
-            for node in processed_nodes
-        ]
+        return [node.to_spec() for node in processed_nodes]
 
     def _convert_info_nodes(
         self, info_nodes: List[InfoNodeSpec]
@@ -197,18 +296,4 @@ class GraphGenerator(ABC):
             List of ProcessingNode
         """
 
-        return [
-            ProcessingNode(
-                id=node.id,
-                question=node.question,
-                rationale=node.rationale,
-                node_type=node.node_type,
-                depends_on_ids=node.depends_on_ids,
-                gathering_method=node.gathering_method,
-                search_queries=node.search_queries,
-                calculation_code=node.calculation_code,
-                calculation_explanation=node.calculation_explanation,
-                input_node_ids=node.input_node_ids,
-            )
-            for node in info_nodes
-        ]
+        return [ProcessingNode.from_spec(node) for node in info_nodes]
@@ -1,8 +1,23 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 
 from app.core.graphs.base import GraphGenerator
 from app.models.tree import InitialInfoGraphWithGoal, ProcessingNode
 
+# Indentation strings by nesting level, so formatting doesn't rebuild them per node
+_INDENTS = tuple("  " * level for level in range(16))
+
+_NodeMapCache = Tuple[
+    List[ProcessingNode],
+    int,
+    Dict[str, ProcessingNode],
+    List[ProcessingNode],
+    Dict[str, List[Tuple[ProcessingNode, int]]],
+]
+
+
+def _indent(level: int) -> str:
+    return _INDENTS[level] if level < len(_INDENTS) else "  " * level
+
 
 class ExplorationGraphGenerator(GraphGenerator):
     """
@@ -10,11 +25,25 @@ class ExplorationGraphGenerator(GraphGenerator):
     using gathered key information.
     """
 
-    def __init__(self, model_dict: Dict[str, List[str]]):
+    def __init__(
+        self, model_dict: Dict[str, List[str]], parallel_providers: bool = True
+    ):
         """Initialize exploration graph generator components."""
-        super().__init__(model_dict=model_dict, prompt_name="exploration_generation")
+        super().__init__(
+            model_dict=model_dict,
+            prompt_name="exploration_generation",
+            parallel_providers=parallel_providers,
+        )
+
+        # Node lookup structures for the last explored-node list we formatted: the
+        # list, its length, the node map, the main nodes and the lines of reasoning
+        # gathered so far (by main node ID). The explored list only ever grows in
+        # place between calls, so they're reused until its identity or length
+        # changes. Kept as one tuple so that providers formatting concurrently
+        # (see `parallel_providers`) never see a mix of two lists' structures.
+        self._node_map_cache: Optional[_NodeMapCache] = None
 
-    def generate_graph(
+    async def generate_graph(
         self,
         goal: str,
         context: str,
@@ -52,7 +81,7 @@ class ExplorationGraphGenerator(GraphGenerator):
                 },
             ]
 
-        return self._generate_sequential_graphs(
+        return await self._generate_sequential_graphs(
             messages_func=create_messages,
             goal=goal,
             context=context,
@@ -73,53 +102,82 @@ class ExplorationGraphGenerator(GraphGenerator):
         if not nodes:
             return "No approaches explored yet."
 
-        approaches = []
-
-        # Create a mapping from node ID to node
-        node_map = {node.id: node for node in nodes}
-
-        # Function to recursively gather all nodes in a line of reasoning
-        def gather_line_of_reasoning(node_id, visited, level=0):
-            if node_id in visited:
-                return []
-            visited.add(node_id)
-            node = node_map.get(node_id)
-            if not node:
-                return []
-            line = [(node, level)]
-            for dep_id in node.depends_on_ids:
-                line.extend(gather_line_of_reasoning(dep_id, visited, level + 1))
-            return line
-
-        # Find all main nodes (nodes with no dependencies)
-        main_nodes = [node for node in nodes if not node.depends_on_ids]
+        # Fragments of the formatted text, joined once at the end
+        parts: List[str] = []
+
+        cache = self._node_map_cache
+        if cache is None or cache[0] is not nodes or cache[1] != len(nodes):
+            cache = (
+                nodes,
+                len(nodes),
+                # Create a mapping from node ID to node
+                {node.id: node for node in nodes},
+                # Find all main nodes (nodes with no dependencies)
+                [node for node in nodes if not node.depends_on_ids],
+                # New nodes can complete lines that referenced them, so regather
+                {},
+            )
+            self._node_map_cache = cache
+        _, _, node_map, main_nodes, lines_of_reasoning = cache
 
         # Gather lines of reasoning starting from each main node
         for main_node in main_nodes:
-            visited = set()
-            line_of_reasoning = gather_line_of_reasoning(main_node.id, visited)
-            approach_info = [f"Approach: {main_node.question}"]
-            approach_info.append(f"Rationale for approach: {main_node.rationale}")
+            line_of_reasoning = lines_of_reasoning.get(main_node.id)
+            if line_of_reasoning is None:
+                line_of_reasoning = self._gather_line_of_reasoning(
+                    main_node.id, node_map
+                )
+                lines_of_reasoning[main_node.id] = line_of_reasoning
+
+            parts += ("Approach: ", main_node.question, "\n")
+            parts += ("Rationale for approach: ", main_node.rationale, "\n")
 
             # Add what we've learned
-            findings = ["Findings:"]
+            parts.append("Findings:\n")
             for node, level in line_of_reasoning:
-                indent = "  " * level
-                formatted_node = (
-                    f"{indent}- ID: {node.id}\n{indent}  Question: {node.question}"
-                )
+                indent = _indent(level)
+                parts += (indent, "- ID: ", node.id, "\n")
+                parts += (indent, "  Question: ", node.question)
                 if node.value:  # If we've learned something
-                    formatted_node += f": {node.value}"
+                    parts += (": ", node.value)
                 if node.depends_on_ids:  # Include dependencies if they exist
-                    dependencies = ", ".join(node.depends_on_ids)
-                    formatted_node += f" (depends on: {dependencies})"
+                    parts += (" (depends on: ", ", ".join(node.depends_on_ids), ")")
+                parts.append("\n")
+
+            parts.append("\n")  # Empty line between approaches
 
-                findings.append(formatted_node)
+        # No newline after the final empty line
+        if parts:
+            parts.pop()
+        return "".join(parts)
+
+    def _gather_line_of_reasoning(
+        self, root_id: str, node_map: Dict[str, ProcessingNode]
+    ) -> List[Tuple[ProcessingNode, int]]:
+        """
+        Gather every node in the line of reasoning under `root_id`, with its depth,
+        in depth-first pre-order along the dependencies. Iterative, so deep graphs
+        can't hit the recursion limit.
+        """
 
-            if findings:
-                approach_info.extend(findings)
+        line: List[Tuple[ProcessingNode, int]] = []
+        visited: Set[str] = set()
+        stack = [(root_id, 0)]
+
+        while stack:
+            node_id, level = stack.pop()
+            if node_id in visited:
+                continue
+            visited.add(node_id)
+
+            node = node_map.get(node_id)
+            if not node:
+                continue
 
-            approach_info.append("")  # Empty line between approaches
-            approaches.extend(approach_info)
+            line.append((node, level))
+            # Push in reverse so dependencies are visited in their listed order
+            stack.extend(
+                (dep_id, level + 1) for dep_id in reversed(node.depends_on_ids)
+            )
 
-        return "\n".join(approaches)
+        return line
@@ -10,11 +10,17 @@ class KeyInfoGraphGenerator(GraphGenerator):
     regardless of implementation approach.
     """
 
-    def __init__(self, model_dict: Dict[str, List[str]]):
+    def __init__(
+        self, model_dict: Dict[str, List[str]], parallel_providers: bool = True
+    ):
         """Initialize key info generator components."""
-        super().__init__(model_dict=model_dict, prompt_name="key_info_generation")
+        super().__init__(
+            model_dict=model_dict,
+            prompt_name="key_info_generation",
+            parallel_providers=parallel_providers,
+        )
 
-    def generate_graph(
+    async def generate_graph(
         self,
         goal: str,
         context: str,
@@ -52,7 +58,7 @@ class KeyInfoGraphGenerator(GraphGenerator):
                 },
             ]
 
-        return self._generate_sequential_graphs(
+        return await self._generate_sequential_graphs(
             messages_func=create_messages,
             goal=goal,
             context=context,
@@ -73,18 +79,19 @@ class KeyInfoGraphGenerator(GraphGenerator):
         if not nodes:
             return "No nodes explored yet."
 
-        formatted = []
+        # Fragments of the formatted text, joined once at the end
+        parts: List[str] = []
         for node in nodes:
-            formatted.append(f"- Question: {node.question}")
-            formatted.append(f"  Rationale for question: {node.rationale}")
-            formatted.append(f"  Node Type: {node.node_type}")
+            parts += ("- Question: ", node.question, "\n")
+            parts += ("  Rationale for question: ", node.rationale, "\n")
+            parts += ("  Node Type: ", str(node.node_type), "\n")
             if node.depends_on_ids:
-                formatted.append(
-                    f"  Depends on nodes: {', '.join(node.depends_on_ids)}"
-                )
+                parts += ("  Depends on nodes: ", ", ".join(node.depends_on_ids), "\n")
             if node.value:
-                formatted.append(f"  Value: {node.value}")
+                parts += ("  Value: ", node.value, "\n")
 
-            formatted.append("")  # Empty line between nodes
+            parts.append("\n")  # Empty line between nodes
 
-        return "\n".join(formatted)
+        # No newline after the final empty line
+        parts.pop()
+        return "".join(parts)
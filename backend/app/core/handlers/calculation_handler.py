@@ -1,8 +1,30 @@
+from functools import lru_cache
+from types import CodeType
 from typing import Any, Dict, List
 
 from app.llm.ensemble import NormalLlmEnsembler
 from app.models.calculation import CalculationResult, CalculationSpec
-from app.prompts import PROMPTS
+from app.prompts import PROMPTS, PromptTemplate
+
+# The only builtins calculation code can use. Copied into each sandbox, so code that
+# tampers with its builtins can't affect other calculations.
+SAFE_BUILTINS = {
+    "abs": abs,
+    "float": float,
+    "int": int,
+    "len": len,
+    "max": max,
+    "min": min,
+    "pow": pow,
+    "round": round,
+    "sum": sum,
+}
+
+
+@lru_cache(maxsize=256)
+def _compile_calculation(code: str) -> CodeType:
+    """Compile calculation code, reusing the code object for code seen before."""
+    return compile(code, "<calculation>", "exec")
 
 
 class CalculationHandler:
@@ -24,9 +46,9 @@ class CalculationHandler:
 
         # Load prompts
         self.system_prompt = PROMPTS["system"]["calculation"]
-        self.user_prompt = PROMPTS["user"]["calculation"]
+        self.user_prompt = PromptTemplate(PROMPTS["user"]["calculation"])
 
-    def generate_calculation(
+    async def generate_calculation(
         self, question: str, available_data: Dict[str, Any]
     ) -> CalculationSpec:
         """
@@ -41,7 +63,7 @@ class CalculationHandler:
         """
 
         # Have LLM generate calculation code
-        response = self.llm_ensembler.call_providers(
+        response = await self.llm_ensembler.call_providers(
             messages=[
                 {"role": "system", "content": self.system_prompt},
                 {
@@ -54,13 +76,30 @@ class CalculationHandler:
             ]
         )
 
-        assert len(response.values()) == 1
-        provider_response = list(response.values())[0]
+        assert len(response) == 1
+        provider_response = next(iter(response.values()))
         assert len(provider_response) == 1
         calculation_spec = provider_response[0]
         assert calculation_spec.code and calculation_spec.explanation
         return calculation_spec
 
+    async def warm_prefix(self, question: str) -> None:
+        """
+        Warm the provider's prompt cache with the part of the calculation prompt that
+        is known before the input data is (system prompt and question).
+
+        Args:
+            question: What we're going to calculate
+        """
+
+        known_prefix = self.user_prompt.template.split("{available_data}")[0]
+        await self.llm_ensembler.warm_prefix(
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": known_prefix.format(question=question)},
+            ]
+        )
+
     def execute_calculation(
         self, spec: CalculationSpec, input_data: Dict[str, Any]
     ) -> CalculationResult:
@@ -78,22 +117,12 @@ class CalculationHandler:
         sandbox_globals = {
             "input_data": input_data,
             "print": print,  # For debugging
-            "__builtins__": {
-                "abs": abs,
-                "float": float,
-                "int": int,
-                "len": len,
-                "max": max,
-                "min": min,
-                "pow": pow,
-                "round": round,
-                "sum": sum,
-            },
+            "__builtins__": dict(SAFE_BUILTINS),
         }
 
         try:
             # Execute in sandbox
-            exec(spec.code, sandbox_globals)
+            exec(_compile_calculation(spec.code), sandbox_globals)
 
             # Get result
             if "result" not in sandbox_globals:
@@ -2,7 +2,7 @@ from typing import Dict, List
 
 from app.llm.ensemble import ReasoningLlmEnsembler
 from app.models.tree import Estimate
-from app.prompts import PROMPTS
+from app.prompts import PROMPTS, PromptTemplate, format_bullets, format_facts
 
 
 class EstimateHandler:
@@ -25,9 +25,9 @@ class EstimateHandler:
 
         # Load prompts
         self.system_prompt = PROMPTS["system"]["estimation"]
-        self.user_prompt = PROMPTS["user"]["estimation"]
+        self.user_prompt = PromptTemplate(PROMPTS["user"]["estimation"])
 
-    def generate_estimate(
+    async def generate_estimate(
         self,
         question: str,
         context: str,
@@ -47,7 +47,7 @@ class EstimateHandler:
             Estimate with value, reasoning, and assumptions
         """
 
-        response = self.llm_ensembler.call_providers(
+        response = await self.llm_ensembler.call_providers(
             messages=[
                 {"role": "system", "content": self.system_prompt},
                 {
@@ -55,20 +55,16 @@ class EstimateHandler:
                     "content": self.user_prompt.format(
                         question=question,
                         context=context,
-                        failed_searches="\n".join(f"- {s}" for s in failed_searches),
-                        known_facts=self._format_facts(known_facts),
+                        failed_searches=format_bullets(failed_searches),
+                        known_facts=format_facts(known_facts),
                     ),
                 },
             ]
         )
 
-        assert len(response.values()) == 1
-        provider_response = list(response.values())[0]
+        assert len(response) == 1
+        provider_response = next(iter(response.values()))
         assert len(provider_response) == 1
         estimate = provider_response[0]
         assert estimate.value and estimate.reasoning and estimate.assumptions
         return estimate
-
-    def _format_facts(self, facts: Dict[str, str]) -> str:
-        """Format known facts for prompt."""
-        return "\n".join(f"- {k}: {v}" for k, v in facts.items())
@@ -1,10 +1,17 @@
+import asyncio
 from typing import Dict, List
 
+from app.caching import BreakdownFileCache
 from app.core.handlers.estimation_handler import EstimateHandler
 from app.core.handlers.search_handler import SearchHandler
 from app.llm.ensemble import ReasoningLlmEnsembler
-from app.models.tree import BreakdownAttempt, FailedSearchAttempt, SearchResultWithURL
-from app.prompts import PROMPTS
+from app.models.tree import (
+    BreakdownAttempt,
+    FailedSearchAttempt,
+    GatherNodeSpec,
+    SearchResultWithURL,
+)
+from app.prompts import PROMPTS, PromptTemplate, format_bullets, format_facts
 
 
 class FailedSearchBreakdownHandler:
@@ -33,11 +40,18 @@ class FailedSearchBreakdownHandler:
         self.search_handler = search_handler
         self.estimate_handler = estimate_handler
 
+        # Breakdowns that found nothing, so repeats go straight to estimation
+        self.failed_breakdown_cache = BreakdownFileCache()
+
         # Load prompts
         self.system_prompt = PROMPTS["system"]["breakdown"]
-        self.user_prompt = PROMPTS["user"]["breakdown"]
+        self.user_prompt = PromptTemplate(PROMPTS["user"]["breakdown"])
+        # Failed breakdowns are only reused while the prompts are unchanged
+        self.prompt_fingerprint = PROMPTS["system"].fingerprint("breakdown") + PROMPTS[
+            "user"
+        ].fingerprint("breakdown")
 
-    def handle_failed_search(
+    async def handle_failed_search(
         self,
         question: str,
         context: str,
@@ -61,8 +75,30 @@ class FailedSearchBreakdownHandler:
             - Estimate if breakdown failed (None if breakdown succeeded)
         """
 
+        # Skip breakdowns we already know don't help
+        breakdown_key = self.failed_breakdown_cache.make_key_for_messages(
+            question, failed_searches, self.prompt_fingerprint
+        )
+        failed_breakdown = self.failed_breakdown_cache.get(breakdown_key)
+        if failed_breakdown:
+            estimate = await self.estimate_handler.generate_estimate(
+                question=question,
+                context=context,
+                failed_searches=failed_searches
+                + [
+                    query.query
+                    for node in failed_breakdown.new_nodes
+                    if isinstance(node, GatherNodeSpec)
+                    for query in node.search_queries or []
+                ],
+                known_facts=known_facts,
+            )
+            return FailedSearchAttempt(
+                breakdown_attempt=failed_breakdown, search_results=[], estimate=estimate
+            )
+
         # Generate breakdown plan
-        breakdown = self.generate_search_breakdown(
+        breakdown = await self.generate_search_breakdown(
             question=question,
             context=context,
             failed_searches=failed_searches,
@@ -72,20 +108,28 @@ class FailedSearchBreakdownHandler:
         # Track any new failed searches
         all_failed_searches = failed_searches.copy()
 
-        # Try searches for each new node
-        all_results: List[SearchResultWithURL] = []
-        for node in breakdown.new_nodes:
-            if node.search_queries:
-                node_results = self.search_handler.search_and_analyze(
+        # Try searches for each new node, all nodes at once
+        search_nodes = [
+            node
+            for node in breakdown.new_nodes
+            if isinstance(node, GatherNodeSpec) and node.search_queries
+        ]
+        node_results_list = await asyncio.gather(
+            *[
+                self.search_handler.search_and_analyze(
                     question=node.question, search_queries=node.search_queries
                 )
-                if node_results:
-                    all_results.extend(node_results)
-                else:
-                    # Track failed searches
-                    all_failed_searches.extend(
-                        query.query for query in node.search_queries
-                    )
+                for node in search_nodes
+            ]
+        )
+
+        all_results: List[SearchResultWithURL] = []
+        for node, node_results in zip(search_nodes, node_results_list):
+            if node_results:
+                all_results.extend(node_results)
+            else:
+                # Track failed searches
+                all_failed_searches.extend(query.query for query in node.search_queries)
 
         # If we found useful information
         if all_results:
@@ -95,7 +139,7 @@ class FailedSearchBreakdownHandler:
             )
 
         # If breakdown failed, fall back to estimation
-        estimate = self.estimate_handler.generate_estimate(
+        estimate = await self.estimate_handler.generate_estimate(
             question=question,
             context=context,
             failed_searches=all_failed_searches,
@@ -103,11 +147,12 @@ class FailedSearchBreakdownHandler:
         )
 
         breakdown.was_successful = False
+        self.failed_breakdown_cache.set(breakdown_key, breakdown)
         return FailedSearchAttempt(
             breakdown_attempt=breakdown, search_results=[], estimate=estimate
         )
 
-    def generate_search_breakdown(
+    async def generate_search_breakdown(
         self,
         question: str,
         context: str,
@@ -127,7 +172,7 @@ class FailedSearchBreakdownHandler:
             BreakdownAttempt with strategy and specific nodes to try
         """
 
-        response = self.llm_ensembler.call_providers(
+        response = await self.llm_ensembler.call_providers(
             messages=[
                 {"role": "system", "content": self.system_prompt},
                 {
@@ -135,17 +180,15 @@ class FailedSearchBreakdownHandler:
                     "content": self.user_prompt.format(
                         question=question,
                         context=context,
-                        failed_searches="\n".join(f"- {s}" for s in failed_searches),
-                        known_facts="\n".join(
-                            f"- {k}: {v}" for k, v in known_facts.items()
-                        ),
+                        failed_searches=format_bullets(failed_searches),
+                        known_facts=format_facts(known_facts),
                     ),
                 },
             ]
         )
 
-        assert len(response.values()) == 1
-        provider_response = list(response.values())[0]
+        assert len(response) == 1
+        provider_response = next(iter(response.values()))
         assert len(provider_response) == 1
         breakdown_attempt = provider_response[0]
         assert (
@@ -1,15 +1,32 @@
+import asyncio
 import logging
-from typing import Dict, List
+import random
+from typing import AsyncIterator, Dict, List, Optional, Set
 
-import tenacity
+import httpx
+import openai
 from app.agents.web_agent import WebAgent
 from app.caching import OpenAIFileCache
 from app.llm.ensemble import NormalLlmEnsembler
-from app.models.tree import SearchQuery, SearchResultList, SearchResultWithURL
-from app.prompts import PROMPTS
+from app.models.cache import URLScrapeRecord
+from app.models.tree import (
+    SearchQuery,
+    SearchResultListBatch,
+    SearchResultWithURL,
+)
+from app.prompts import PROMPTS, PromptTemplate
 
 logger = logging.getLogger(__name__)
 
+# Attempts per analysis call; only errors that may go away on retry are retried
+ANALYSIS_ATTEMPTS = 3
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.HTTPError,
+)
+
 
 class SearchHandler:
     """
@@ -24,8 +41,21 @@ class SearchHandler:
         perplexity_model: str = "llama-3.1-sonar-large-128k-online",
         perplexity_request_timeout: int = 30,
         scrape_citations_timeout: int = 10,
+        http_client: Optional[httpx.AsyncClient] = None,
+        pages_per_analysis: int = 4,
+        min_good_results: Optional[int] = 3,
     ):
-        """Initialize search and analysis components."""
+        """
+        Initialize search and analysis components.
+
+        Scraped pages are analyzed `pages_per_analysis` at a time, in a single LLM
+        call per batch, so the system prompt and request overhead are paid once per
+        batch rather than once per page.
+
+        Once `min_good_results` useful results have been found, the remaining
+        scrapes and analyses for that search are cancelled (None analyzes every
+        page).
+        """
 
         assert len(model_dict.keys()) == 1, "Only one provider supported now"
         assert len(list(model_dict.values())[0]) == 1, "Only one model supported now"
@@ -34,23 +64,27 @@ class SearchHandler:
             perplexity_model=perplexity_model,
             perplexity_request_timeout=perplexity_request_timeout,
             scrape_citations_timeout=scrape_citations_timeout,
+            http_client=http_client,
         )
 
         # For analyzing search results
         # The evaluations we're doing should be relatively simple, so we can use the
         # normal LLM ensembler.
         self.llm_ensembler = NormalLlmEnsembler(
-            model_dict=model_dict, response_format=SearchResultList
+            model_dict=model_dict, response_format=SearchResultListBatch
         )
 
+        self.pages_per_analysis = pages_per_analysis
+        self.min_good_results = min_good_results
+
         # Cache for analysis results
-        self.cache = OpenAIFileCache(cache_file="search_analysis_cache.json")
+        self.cache = OpenAIFileCache(cache_file="search_analysis_cache.jsonl")
 
         # Load prompts
         self.system_prompt = PROMPTS["system"]["content_analysis"]
-        self.user_prompt = PROMPTS["user"]["content_analysis"]
+        self.user_prompt = PromptTemplate(PROMPTS["user"]["content_analysis"])
 
-    def search_and_analyze(
+    async def search_and_analyze(
         self, question: str, search_queries: List[SearchQuery]
     ) -> List[SearchResultWithURL]:
         """
@@ -65,77 +99,158 @@ class SearchHandler:
             Empty list if no useful results found.
         """
 
-        # Execute all searches
-        citations = []
+        return [
+            result
+            async for page_results in self.iter_search_and_analyze(
+                question, search_queries
+            )
+            for result in page_results
+        ]
+
+    async def iter_search_and_analyze(
+        self, question: str, search_queries: List[SearchQuery]
+    ) -> AsyncIterator[List[SearchResultWithURL]]:
+        """
+        Like `search_and_analyze`, but yields the useful results of each page as
+        soon as that page has been analyzed, so callers can show partial answers.
+        Pages without useful results are skipped. Stops early once
+        `min_good_results` results have been yielded.
+        """
+
+        # Execute all searches concurrently
         for query in search_queries:
             logger.info(f"Searching for: {query.query}")
-            citations.extend(self.web_agent.search(query.query))
+        query_citations = await asyncio.gather(
+            *(self.web_agent.search(query.query) for query in search_queries)
+        )
+        citations = [url for urls in query_citations for url in urls]
 
         if not citations:
             logger.info("No citations found")
-            return []
+            return
 
-        # Scrape content from citations
-        logger.info(f"Scraping content from {len(citations)} citations")
-        content = self.web_agent.scrape_citations(citations)
+        # Scrape content from citations, analyzing pages in batches as they arrive
+        # instead of waiting for every page first
+        logger.info(f"Scraping and analyzing content from {len(citations)} citations")
+        pages = self.web_agent.iter_scrape_citations(citations)
+        next_page: Optional[asyncio.Future] = asyncio.ensure_future(anext(pages))
+        analyses: Set[asyncio.Task] = set()
+        batch: List[URLScrapeRecord] = []
+        results_found = 0
 
-        if not content:
-            return []
+        try:
+            while next_page or analyses:
+                waiting = (analyses | {next_page}) if next_page else analyses
+                done, _ = await asyncio.wait(
+                    waiting, return_when=asyncio.FIRST_COMPLETED
+                )
 
-        # Analyze content in parallel with retries
-        logger.info(f"Analyzing content from {len(content)} pages")
-        results = [
-            self._analyze_content_with_retry(
-                question=question, content=page.content, source_url=page.url
-            )
-            for page in content
-        ]
+                if next_page in done:
+                    try:
+                        batch.append(next_page.result())
+                        next_page = asyncio.ensure_future(anext(pages))
+                    except StopAsyncIteration:
+                        next_page = None
 
-        # Flatten results list and remove empty results
-        all_results = [
-            result
-            for sublist in results
-            if sublist  # Handle None from failed retries
-            for result in sublist
-        ]
+                    # Start analyzing full batches, and the last partial one
+                    if len(batch) == self.pages_per_analysis or (
+                        batch and next_page is None
+                    ):
+                        analyses.add(
+                            asyncio.create_task(
+                                self._analyze_content_with_retry(
+                                    question=question, pages=batch
+                                )
+                            )
+                        )
+                        batch = []
 
-        return all_results
+                for analysis in done & analyses:
+                    analyses.discard(analysis)
+                    for page_results in analysis.result():
+                        # Skip pages without useful results
+                        if page_results:
+                            yield page_results
+                            results_found += len(page_results)
 
-    @tenacity.retry(
-        stop=tenacity.stop_after_attempt(3),
-        wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-        retry=tenacity.retry_if_exception_type(Exception),
-    )
-    def _analyze_content_with_retry(
-        self, question: str, content: str, source_url: str
-    ) -> List[SearchResultWithURL]:
-        """Analyze content with retry logic."""
+                    if (
+                        self.min_good_results is not None
+                        and results_found >= self.min_good_results
+                    ):
+                        logger.info(f"Found {results_found} results, stopping early")
+                        return
+        finally:
+            # Don't leave scrapes or analyses running if we failed or the caller
+            # stopped early
+            for task in analyses:
+                task.cancel()
+            if next_page:
+                next_page.cancel()
+                await asyncio.gather(next_page, return_exceptions=True)
+            await pages.aclose()
+
+    async def _analyze_content_with_retry(
+        self, question: str, pages: List[URLScrapeRecord]
+    ) -> List[List[SearchResultWithURL]]:
+        """
+        Analyze a batch of pages in one LLM call, retrying transient API errors with
+        jittered exponential backoff.
+
+        Returns:
+            The results found on each page, in the order of `pages`
+        """
+        for attempt in range(ANALYSIS_ATTEMPTS):
+            try:
+                return await self._analyze_content(question, pages)
+            except TRANSIENT_ERRORS as e:
+                if attempt == ANALYSIS_ATTEMPTS - 1:
+                    raise
+                delay = min(10, 4 * 2**attempt + random.random())
+                logger.warning(f"Analysis failed ({str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _analyze_content(
+        self, question: str, pages: List[URLScrapeRecord]
+    ) -> List[List[SearchResultWithURL]]:
+        """Analyze a batch of pages in one LLM call."""
         try:
-            response = self.llm_ensembler.call_providers(
+            response = await self.llm_ensembler.call_providers(
                 [
                     {"role": "system", "content": self.system_prompt},
                     {
                         "role": "user",
                         "content": self.user_prompt.format(
-                            question=question, content=content
+                            question=question, pages=self._format_pages(pages)
                         ),
                     },
                 ]
             )
 
-            results_with_url = []
-            assert len(response.values()) == 1
-            provider_response = list(response.values())[0]
+            assert len(response) == 1
+            provider_response = next(iter(response.values()))
             assert len(provider_response) == 1
-            search_results = provider_response[0]
+            batch_results = provider_response[0]
 
-            for result in search_results.results:
-                results_with_url.append(
+            # Match results back to their pages; unknown page indices are dropped
+            results_with_url: List[List[SearchResultWithURL]] = [[] for _ in pages]
+            for page_results in batch_results.pages:
+                if not 0 <= page_results.page_idx < len(pages):
+                    continue
+                source_url = pages[page_results.page_idx].url
+                results_with_url[page_results.page_idx].extend(
                     SearchResultWithURL(search_result=result, source_url=source_url)
+                    for result in page_results.results
                 )
 
             return results_with_url
 
         except Exception as e:
-            print(f"Error analyzing content from {source_url}: {str(e)}")
+            urls = ", ".join(page.url for page in pages)
+            print(f"Error analyzing content from {urls}: {str(e)}")
             raise
+
+    def _format_pages(self, pages: List[URLScrapeRecord]) -> str:
+        """Format a batch of pages for prompt, each under its [PAGE i] marker."""
+        return "\n\n".join(
+            f"[PAGE {i}]\n{page.content}" for i, page in enumerate(pages)
+        )
@@ -2,8 +2,8 @@ from typing import Dict, List
 
 from app.llm.ensemble import ReasoningLlmEnsembler
 from app.models.recommendation import RecommendationSet
-from app.models.tree import ProcessingGraph
-from app.prompts import PROMPTS
+from app.models.tree import ProcessingGraph, ProcessingNode
+from app.prompts import PROMPTS, PromptTemplate
 
 
 class RecommendationGenerator:
@@ -26,9 +26,9 @@ class RecommendationGenerator:
         )
 
         self.system_prompt = PROMPTS["system"]["recommendation"]
-        self.user_prompt = PROMPTS["user"]["recommendation"]
+        self.user_prompt = PromptTemplate(PROMPTS["user"]["recommendation"])
 
-    def generate_recommendations(
+    async def generate_recommendations(
         self,
         key_info_graph: ProcessingGraph,
         exploration_graph: ProcessingGraph,
@@ -49,7 +49,7 @@ class RecommendationGenerator:
         explored_approaches = self._format_graph_results(exploration_graph)
 
         # Generate recommendations
-        response = self.llm_ensembler.call_providers(
+        response = await self.llm_ensembler.call_providers(
             messages=[
                 {"role": "system", "content": self.system_prompt},
                 {
@@ -63,39 +63,51 @@ class RecommendationGenerator:
             ]
         )
 
-        assert len(response.values()) == 1
-        provider_response = list(response.values())[0]
+        assert len(response) == 1
+        provider_response = next(iter(response.values()))
         assert len(provider_response) == 1
         recommendation_set = provider_response[0]
         assert recommendation_set.primary_recommendation
         return recommendation_set
 
     def _format_graph_results(self, graph: ProcessingGraph) -> str:
-        """Format graph results for prompt."""
-
-        lines = []
-        for node in graph.nodes:
-            if not node.value:
-                continue
-
-            lines.append(f"Question: {node.question}")
-            lines.append(f"Answer: {node.value}")
-            lines.append(f"Source: {node.value_source}")
-
-            if node.search_results:
-                lines.append("Supporting Evidence:")
-                for result in node.search_results:
-                    lines.append(f"  - {result.search_result.fact}")
-                    lines.append(f"    Quote: {result.search_result.quote}")
-                    lines.append(f"    Source: {result.source_url}")
-
-            if node.estimate:
-                lines.append("Estimation Details:")
-                lines.append(f"  Reasoning: {node.estimate.reasoning}")
-                lines.append("  Assumptions:")
-                for assumption in node.estimate.assumptions:
-                    lines.append(f"    - {assumption}")
-
-            lines.append("")  # Empty line between nodes
-
-        return "\n".join(lines)
+        """
+        Format graph results for prompt. Nodes are sorted by ID so the same graph
+        always gives the same prompt, whatever order its nodes finished in.
+        """
+
+        return "\n".join(
+            self._format_node(node)
+            for node in sorted(graph.nodes, key=lambda node: node.id)
+            if node.value
+        )
+
+    def _format_node(self, node: ProcessingNode) -> str:
+        """Format one answered node, followed by an empty line."""
+
+        evidence = ""
+        if node.search_results:
+            evidence = "Supporting Evidence:\n" + "".join(
+                f"  - {result.search_result.fact}\n"
+                f"    Quote: {result.search_result.quote}\n"
+                f"    Source: {result.source_url}\n"
+                for result in node.search_results
+            )
+
+        estimation = ""
+        if node.estimate:
+            estimation = (
+                "Estimation Details:\n"
+                f"  Reasoning: {node.estimate.reasoning}\n"
+                "  Assumptions:\n"
+                + "".join(
+                    f"    - {assumption}\n" for assumption in node.estimate.assumptions
+                )
+            )
+
+        return (
+            f"Question: {node.question}\n"
+            f"Answer: {node.value}\n"
+            f"Source: {node.value_source}\n"
+            f"{evidence}{estimation}"
+        )
@@ -1,13 +1,62 @@
+import asyncio
 import logging
 import os
-from typing import Dict, List
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
-from app.caching import OpenAIFileCache
-from openai import OpenAI
+import httpx
+from app.caching import (
+    OpenAICallRecord,
+    OpenAIFileCache,
+    SemanticCache,
+    get_shared_redis_cache,
+)
+from app.caching.redis_cache import CACHE_TTLS
+from openai import AsyncOpenAI
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
+# Connection limits of the HTTP pool shared by every OpenAI client in the process
+LLM_MAX_CONNECTIONS = 200
+LLM_MAX_KEEPALIVE_CONNECTIONS = 100
+
+
+@lru_cache(maxsize=None)
+def get_shared_client() -> AsyncOpenAI:
+    """
+    The process-wide OpenAI client. Ensemblers derive their clients from it (with
+    `with_options`), so they all share its connection pool instead of each paying
+    for their own TCP/TLS handshakes.
+    """
+    return AsyncOpenAI(
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            )
+        )
+    )
+
+
+# Setting this turns on the semantic cache: prompts whose embeddings are at least this
+# similar to an earlier call's are answered from that call's cached output
+SEMANTIC_CACHE_THRESHOLD = os.getenv("SEMANTIC_CACHE_THRESHOLD")
+
+# Shared by all ensemblers, so every call made by this process can be matched
+_shared_semantic_cache: Optional[SemanticCache] = None
+
+
+def get_shared_semantic_cache() -> Optional[SemanticCache]:
+    """The process-wide semantic cache, or None if it isn't turned on."""
+
+    global _shared_semantic_cache
+    if SEMANTIC_CACHE_THRESHOLD and _shared_semantic_cache is None:
+        _shared_semantic_cache = SemanticCache(
+            threshold=float(SEMANTIC_CACHE_THRESHOLD), client=get_shared_client()
+        )
+    return _shared_semantic_cache
+
 
 class BaseLlmEnsembler:
     """
@@ -15,41 +64,158 @@ class BaseLlmEnsembler:
     appropriate models in parallel with the same messages.
     """
 
-    def __init__(self, model_dict: Dict[str, List[str]], response_format: BaseModel):
+    def __init__(
+        self,
+        model_dict: Dict[str, List[str]],
+        response_format: BaseModel,
+        semantic_cache: Optional[SemanticCache] = None,
+        client: Optional[AsyncOpenAI] = None,
+        cache_ttl: int = CACHE_TTLS["generation"],
+    ):
         """
         model_dict example:
         {
           "OPENAI": ["o1-preview"],
           "GEMINI": ["gemini-2.0-flash-thinking-exp-1219"],
         }
+
+        `semantic_cache` defaults to the shared one (see SEMANTIC_CACHE_THRESHOLD),
+        and `client` to the shared client (see `get_shared_client`). `cache_ttl` is
+        how long responses stay in the Redis cache, if REDIS_URL is set.
         """
 
         self.model_dict = model_dict
         self.response_format = response_format
         self.cache = OpenAIFileCache()
-        self.client = OpenAI()
+        self.redis_cache = get_shared_redis_cache(OpenAICallRecord, "openai")
+        self.cache_ttl = cache_ttl
+        self.semantic_cache = semantic_cache or get_shared_semantic_cache()
+        self.async_client = client or get_shared_client()
+        if self.semantic_cache is not None:
+            self.semantic_cache.index_cache(self.cache)
 
         for provider_name in model_dict.keys():
             if not os.getenv(f"{provider_name}_API_KEY"):
                 raise ValueError(f"Missing API key for {provider_name}")
 
-    def call_providers(self, messages: List[dict]) -> Dict[str, List[BaseModel]]:
+        # One client per provider with its API key baked in, all sharing the
+        # pool of `async_client`; never mutated, so concurrent calls can't mix keys
+        self._clients: Dict[str, AsyncOpenAI] = {}
+        for provider_name in model_dict.keys():
+            self.client_for(provider_name)
+
+    def client_for(self, provider: str) -> AsyncOpenAI:
+        """The client that calls `provider`'s models with its API key."""
+        if provider not in self._clients:
+            self._clients[provider] = self.async_client.with_options(
+                api_key=os.getenv(f"{provider}_API_KEY")
+            )
+        return self._clients[provider]
+
+    async def call_providers(self, messages: List[dict]) -> Dict[str, List[BaseModel]]:
         """
-        For each provider, call each model in parallel.
+        For each provider, call each model concurrently.
         Return a dict: {provider -> [BaseModel, ...]}, where each BaseModel is of the
         type specified in `response_format`.
         """
 
-        result_map: Dict[str, List[BaseModel]] = dict()
+        responses = await asyncio.gather(
+            *[
+                self._call_models_for_provider(
+                    provider=provider, models=models, messages=messages
+                )
+                for provider, models in self.model_dict.items()
+            ]
+        )
+        return dict(zip(self.model_dict.keys(), responses))
+
+    async def warm_prefix(self, messages: List[Dict[str, str]]) -> None:
+        """
+        Send `messages` to every model with a one-token completion and discard the
+        output. Used to get a prompt prefix into the provider's prompt cache before
+        the real request is made. Failures are logged and ignored.
+        """
+
         for provider, models in self.model_dict.items():
-            responses = self._call_models_for_provider(
-                provider=provider, models=models, messages=messages
+            for model in models:
+                try:
+                    await self.client_for(provider).chat.completions.create(
+                        model=model, messages=messages, max_tokens=1
+                    )
+                except Exception as e:
+                    logger.warning(f"Prefix warm-up failed for {model}: {str(e)}")
+
+    async def _lookup_cache(
+        self, model_name: str, messages: List[Dict[str, str]]
+    ) -> Tuple[str, Optional[OpenAICallRecord], Optional[List[float]]]:
+        """
+        Look for a cached call: by exact (whitespace-normalized) key, then by the
+        un-normalized key older cache files used, then in Redis if it's set up, then
+        by a similar prompt if there is a semantic cache.
+
+        Returns:
+            Tuple of:
+            - The key to cache a new call's result under
+            - The cached record, or None on a miss
+            - The prompt's embedding if one was made, to pass to `_store_cache`
+        """
+
+        cache_key = self.cache.make_key_for_messages(model_name, messages)
+        cached = self.cache.get(cache_key)
+        if cached:
+            return cache_key, cached, None
+
+        cached = self.cache.get(
+            self.cache.make_key_for_messages(model_name, messages, normalize=False)
+        )
+        if cached:
+            # Copy it over so the next lookup hits the first key
+            self.cache.set(cache_key, cached)
+            return cache_key, cached, None
+
+        if self.redis_cache is not None:
+            cached = await self.redis_cache.lookup(cache_key)
+            if cached:
+                # Another worker made this call; keep it locally too
+                self.cache.set(cache_key, cached)
+                return cache_key, cached, None
+
+        if self.semantic_cache is None:
+            return cache_key, None, None
+
+        try:
+            similar_key, embedding = await self.semantic_cache.lookup(
+                model_name, messages
             )
-            result_map[provider] = responses
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {str(e)}")
+            return cache_key, None, None
 
-        return result_map
+        if similar_key:
+            logger.info(f"Semantic cache hit for {model_name}")
+            return cache_key, self.cache.get(similar_key), embedding
+        return cache_key, None, embedding
+
+    async def _store_cache(
+        self,
+        cache_key: str,
+        record: OpenAICallRecord,
+        embedding: Optional[List[float]],
+    ) -> None:
+        """
+        Cache a call's record (in Redis too, if it's set up), indexing its prompt in
+        the semantic cache.
+        """
+
+        self.cache.set(cache_key, record)
+        if self.semantic_cache is not None and embedding is not None:
+            self.semantic_cache.add(
+                record.model, record.messages, cache_key, embedding, self.cache
+            )
+        if self.redis_cache is not None:
+            await self.redis_cache.update(cache_key, record, self.cache_ttl)
 
-    def _call_models_for_provider(
+    async def _call_models_for_provider(
         self,
         provider: str,
         models: List[str],
@@ -1,14 +1,122 @@
+import asyncio
+import copy
 import logging
-import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
 
+import orjson
 from app.caching import OpenAICallRecord
 from app.llm.base import BaseLlmEnsembler
-from pydantic import BaseModel
+from openai import AsyncOpenAI, BadRequestError
+from pydantic import BaseModel, ValidationError
 
 logger = logging.getLogger(__name__)
 
+# Reasoning models without structured outputs end their answer with the JSON in this
+JSON_BLOCK_RE = re.compile(r"<json>(.*?)</json>", re.DOTALL)
+JSON_BLOCK_INSTRUCTIONS = "\nEnd your answer with the JSON, wrapped in <json></json>."
+
+
+@lru_cache(maxsize=None)
+def _schema_instructions(response_format: Type[BaseModel]) -> str:
+    """
+    Prompt line giving the JSON schema of `response_format`. Schemas are generated
+    once per model class rather than on every request.
+    """
+    schema = orjson.dumps(response_format.model_json_schema()).decode("utf-8")
+    return f"\nReturn your answer with schema: {schema}"
+
+
+def _make_strict(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rewrite a pydantic JSON schema in place into the form strict structured outputs
+    accept: objects closed to extra properties with every property required, no
+    None defaults, and no `$ref`s with sibling keys (those are inlined).
+    """
+
+    for definitions in (schema.get("$defs"), schema.get("definitions")):
+        for definition in (definitions or {}).values():
+            _make_strict(definition, root)
+
+    if schema.get("type") == "object":
+        schema.setdefault("additionalProperties", False)
+    if "properties" in schema:
+        schema["required"] = list(schema["properties"])
+        for prop in schema["properties"].values():
+            _make_strict(prop, root)
+    if isinstance(schema.get("items"), dict):
+        _make_strict(schema["items"], root)
+    for variant in schema.get("anyOf", []):
+        _make_strict(variant, root)
+
+    all_of = schema.get("allOf")
+    if all_of and len(all_of) == 1:
+        schema.update(_make_strict(schema.pop("allOf")[0], root))
+    else:
+        for entry in all_of or []:
+            _make_strict(entry, root)
+
+    if "default" in schema and schema["default"] is None:
+        del schema["default"]
+
+    if "$ref" in schema and len(schema) > 1:
+        resolved = root
+        for key in schema.pop("$ref")[2:].split("/"):
+            resolved = resolved[key]
+        # Keys next to the $ref take priority over the referenced schema's
+        schema.update({**copy.deepcopy(resolved), **schema})
+        return _make_strict(schema, root)
+
+    return schema
+
+
+@lru_cache(maxsize=None)
+def get_response_format(response_format: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    The strict JSON schema `response_format` param for a model class, like the one
+    the SDK's `parse` builds. Built once per class; `parse` rebuilds it on every
+    request.
+    """
+    schema = response_format.model_json_schema()
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "schema": _make_strict(schema, schema),
+            "name": response_format.__name__,
+            "strict": True,
+        },
+    }
+
+
+def _is_unsupported_response_format(error: BadRequestError) -> bool:
+    """Whether a request was rejected because the model can't do structured output."""
+    return error.param == "response_format" or "response_format" in error.message
+
+
+async def create_structured(
+    client: AsyncOpenAI, response_format: Type[BaseModel], **kwargs: Any
+) -> Tuple[BaseModel, str]:
+    """
+    Like `client.beta.chat.completions.parse`, but with the schema built once per
+    model class (see `get_response_format`).
+
+    Returns:
+        Tuple of the parsed output and the raw message content
+    """
+
+    response = await client.chat.completions.create(
+        response_format=get_response_format(response_format), **kwargs
+    )
+    choice = response.choices[0]
+    if not choice.message.content:
+        raise ValueError(
+            "No structured output: "
+            f"{choice.message.refusal or f'finish reason {choice.finish_reason}'}"
+        )
+    content = choice.message.content
+    return response_format.model_validate_json(content), content
+
 
 class NormalLlmEnsembler(BaseLlmEnsembler):
     """
@@ -16,15 +124,16 @@ class NormalLlmEnsembler(BaseLlmEnsembler):
     There can be one or many, from as many providers as you like.
     """
 
-    def _call_models_for_provider(
+    async def _call_models_for_provider(
         self,
         provider: str,
         models: List[str],
         messages: List[Dict[str, str]],
     ) -> List[BaseModel]:
-        def call_model(model_name: str) -> BaseModel:
-            cache_key = self.cache.make_key_for_messages(model_name, messages)
-            cached = self.cache.get(cache_key)
+        async def call_model(model_name: str) -> BaseModel:
+            cache_key, cached, embedding = await self._lookup_cache(
+                model_name, messages
+            )
             if cached:
                 logger.info(f"Cache hit for {model_name}")
                 return self.response_format.model_validate(
@@ -32,51 +141,54 @@ class NormalLlmEnsembler(BaseLlmEnsembler):
                 )
 
             logger.info(f"Calling model {model_name}...")
-            self.client.api_key = os.getenv(f"{provider}_API_KEY")
-            response = self.client.beta.chat.completions.parse(
+            client = self.client_for(provider)
+            output, _ = await create_structured(
+                client,
+                self.response_format,
                 model=model_name,
                 messages=messages,
                 temperature=0,
-                response_format=self.response_format,
             )
 
-            output = response.choices[0].message.parsed
-
             record = OpenAICallRecord(
                 model=model_name,
                 messages=messages,
                 structured_output_dict=output.model_dump(),
             )
 
-            self.cache.set(cache_key, record)
+            await self._store_cache(cache_key, record, embedding)
 
             return output
 
-        responses = []
-        with ThreadPoolExecutor(max_workers=len(models)) as executor:
-            futures = [executor.submit(call_model, m) for m in models]
-
-        for future in as_completed(futures):
-            responses.append(future.result())
-
-        return responses
+        return list(await asyncio.gather(*[call_model(m) for m in models]))
 
 
 class ReasoningLlmEnsembler(BaseLlmEnsembler):
     """
     Use this specifically for reasoning models (e.g. "o1-preview").
     There can be one or many, from as many providers as you like.
+
+    Models are asked for structured output directly. Models that don't support it
+    are asked to end their answer with a <json> block that is parsed locally;
+    GPT-4o only reformats answers where that fails.
     """
 
-    def _call_models_for_provider(
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+
+        # Models that rejected structured output as unsupported
+        self._no_structured_output: Set[str] = set()
+
+    async def _call_models_for_provider(
         self,
         provider: str,
         models: List[str],
         messages: List[Dict[str, str]],
     ) -> List[BaseModel]:
-        def call_model(model_name: str) -> BaseModel:
-            cache_key = self.cache.make_key_for_messages(model_name, messages)
-            cached = self.cache.get(cache_key)
+        async def call_model(model_name: str) -> BaseModel:
+            cache_key, cached, embedding = await self._lookup_cache(
+                model_name, messages
+            )
             if cached:
                 logger.info(f"Cache hit for {model_name}")
                 return self.response_format.model_validate(
@@ -84,77 +196,110 @@ class ReasoningLlmEnsembler(BaseLlmEnsembler):
                 )
 
             logger.info(f"Calling reasoning model {model_name}...")
-            self.client.api_key = os.getenv(f"{provider}_API_KEY")
-            reasoning_response = self.client.chat.completions.create(
-                model=model_name,
-                messages=self._format_reasoning_messages(messages),
-                # temperature=0,
-                # response_format=self.response_format,
-            )
+            client = self.client_for(provider)
 
-            # Use GPT-4o to get structured output from the reasoning models.
-            # Currently, reasoning models don't allow using structured outputs.
-            logger.info("Calling GPT-4o for structured output...")
-            self.client.api_key = os.getenv("OPENAI_API_KEY")
-            structured_response = self.client.beta.chat.completions.parse(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": (
-                            "Given the following data, format it with the given "
-                            "response format:\n"
-                            + reasoning_response.choices[0].message.content
-                        ),
-                    }
-                ],
-                temperature=0,
-                response_format=self.response_format,
-            )
+            # Ask for structured output directly if the model supports it
+            output = None
+            if model_name not in self._no_structured_output:
+                try:
+                    output, reasoning_output = await create_structured(
+                        client,
+                        self.response_format,
+                        model=model_name,
+                        messages=self._format_reasoning_messages(messages),
+                    )
+                except BadRequestError as e:
+                    if not _is_unsupported_response_format(e):
+                        raise
+                    logger.info(f"No structured output for {model_name}: {str(e)}")
+                    self._no_structured_output.add(model_name)
+                except ValueError as e:
+                    # Refused or invalid output; the <json> block path may still work
+                    logger.info(f"Unusable structured output from {model_name}: {e}")
 
-            output = structured_response.choices[0].message.parsed
             if not output:
-                raise ValueError("Failed to parse structured output")
+                # Otherwise have it end its answer with the JSON, and parse that
+                reasoning_response = await client.chat.completions.create(
+                    model=model_name,
+                    messages=self._format_reasoning_messages(messages, json_block=True),
+                )
+                reasoning_output = reasoning_response.choices[0].message.content
+                output = self._parse_json_block(reasoning_output)
+
+            if not output:
+                output = await self._format_with_gpt4o(reasoning_output)
 
             record = OpenAICallRecord(
                 model=model_name,
                 messages=messages,
                 structured_output_dict=output.model_dump(),
-                reasoning_output=reasoning_response.choices[0].message.content,
+                reasoning_output=reasoning_output,
             )
 
-            self.cache.set(cache_key, record)
+            await self._store_cache(cache_key, record, embedding)
 
             return output
 
-        responses = []
-        with ThreadPoolExecutor(max_workers=len(models)) as executor:
-            futures = [executor.submit(call_model, m) for m in models]
+        return list(await asyncio.gather(*[call_model(m) for m in models]))
+
+    def _parse_json_block(self, reasoning_output: str) -> Optional[BaseModel]:
+        """Parse the answer's last <json> block; None if there's no valid one."""
+
+        blocks = JSON_BLOCK_RE.findall(reasoning_output or "")
+        if not blocks:
+            return None
+        try:
+            return self.response_format.model_validate_json(blocks[-1])
+        except ValidationError as e:
+            logger.info(f"Invalid JSON block in reasoning output: {str(e)}")
+            return None
 
-        for future in as_completed(futures):
-            responses.append(future.result())
+    async def _format_with_gpt4o(self, reasoning_output: str) -> BaseModel:
+        """
+        Last resort for reasoning output without usable JSON: have GPT-4o format it
+        with the response format.
+        """
 
-        return responses
+        logger.info("Calling GPT-4o for structured output...")
+        output, _ = await create_structured(
+            self.client_for("OPENAI"),
+            self.response_format,
+            model="gpt-4o",
+            messages=[
+                {
+                    "role": "user",
+                    "content": (
+                        "Given the following data, format it with the given "
+                        "response format:\n" + reasoning_output
+                    ),
+                }
+            ],
+            temperature=0,
+        )
+        return output
 
     def _format_reasoning_messages(
-        self, messages: List[Dict[str, str]]
+        self, messages: List[Dict[str, str]], json_block: bool = False
     ) -> List[Dict[str, str]]:
         assert len(messages) == 2
         assert messages[0]["role"] == "system"
         assert messages[1]["role"] == "user"
 
-        # Currently, reasoning models only allow us to use a single user message.
-        # It also doesn't support structured outputs.
+        # Currently, reasoning models only allow us to use a single user message,
+        # and not all of them support structured outputs.
         # So, we pack system + user messages and schema into a single user message.
+        # The static parts (instructions and schema) go first and the user message
+        # last, so requests with the same system prompt share a cacheable prefix.
         return [
             {
                 "role": "user",
                 "content": (
                     "INSTRUCTIONS:\n"
                     + messages[0]["content"]  # system message
+                    + _schema_instructions(self.response_format)
+                    + (JSON_BLOCK_INSTRUCTIONS if json_block else "")
                     + "\n\n"
                     + messages[1]["content"]  # user message
-                    + f"\nReturn your answer with schema: {self.response_format.model_json_schema()}"  # noqa: E501
                 ),
             },
         ]
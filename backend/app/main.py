@@ -1,15 +1,19 @@
 import asyncio
 import logging
-from typing import Dict
+import os
+from typing import Tuple
 
-from app.agents.idea_agent import WebSocketIdeaAgent
+import orjson
+from app.agents.idea_agent import ConnectionManager, WebSocketIdeaAgent
+from cachetools import LRUCache
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Idea Explorer API")
+app = FastAPI(title="Idea Explorer API", default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -27,54 +31,100 @@ REASONING_MODEL_DICT = {
 
 NORMAL_MODEL_DICT = {"OPENAI": ["gpt-4o"]}
 
-# Store active agents
-active_agents: Dict[str, WebSocketIdeaAgent] = {}
+# Most sessions served at once; past this, the oldest session is closed
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1024"))
+
+
+class SessionCache(LRUCache):
+    """
+    Active sessions: session ID -> (agent, task serving its websocket). Once there
+    are more than `maxsize`, the least recently registered session is evicted and
+    its task cancelled, which closes it through its own cleanup.
+    """
+
+    def popitem(self) -> Tuple[str, Tuple[WebSocketIdeaAgent, asyncio.Task]]:
+        session_id, (agent, task) = super().popitem()
+        logger.warning(f"Too many sessions, closing session {session_id}")
+        task.cancel()
+        return session_id, (agent, task)
+
+
+active_agents = SessionCache(maxsize=MAX_SESSIONS)
+
+# One manager routes updates to every session's websocket
+connection_manager = ConnectionManager()
+
+
+def register_session(session_id: str, agent: WebSocketIdeaAgent) -> None:
+    """
+    Track a session served by the current task. If there are too many sessions, the
+    oldest one is closed (see `SessionCache`).
+    """
+
+    active_agents[session_id] = (agent, asyncio.current_task())
 
 
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    try:
-        # Create new agent for this session
-        agent = WebSocketIdeaAgent(
-            session_id=session_id,
-            reasoning_model_dict=REASONING_MODEL_DICT,
-            normal_model_dict=NORMAL_MODEL_DICT,
-        )
-        active_agents[session_id] = agent
+    # Create new agent for this session
+    agent = WebSocketIdeaAgent(
+        session_id=session_id,
+        manager=connection_manager,
+        reasoning_model_dict=REASONING_MODEL_DICT,
+        normal_model_dict=NORMAL_MODEL_DICT,
+    )
+    register_session(session_id, agent)
 
+    try:
         # Connect websocket
-        await agent.manager.connect(websocket, session_id)
-
-        try:
-            while True:
-                data = await websocket.receive_json()
-                logger.info(f"Received message: {data}")
+        await connection_manager.connect(websocket, session_id)
 
-                if data["type"] == "process_goal":
-                    asyncio.create_task(
-                        agent.process_goal(data["goal"], data.get("context", ""))
-                    )
+        while True:
+            # Parsed with orjson rather than receive_json's stdlib json
+            data = orjson.loads(await websocket.receive_text())
+            logger.info(f"Received message: {data}")
 
-                elif data["type"] == "user_input":
-                    await agent.set_user_input(data["node_id"], data["input"])
+            if data["type"] == "process_goal":
+                agent.start_goal(data["goal"], data.get("context", ""))
 
-        except WebSocketDisconnect:
-            logger.info(f"WebSocket disconnected for session {session_id}")
-        finally:
-            agent.manager.disconnect(session_id)
-            active_agents.pop(session_id, None)
+            elif data["type"] == "user_input":
+                await agent.set_user_input(data["node_id"], data["input"])
 
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket disconnected for session {session_id}")
     except Exception as e:
         logger.error(f"Error in websocket endpoint: {str(e)}", exc_info=True)
         raise
     finally:
-        # Cleanup
-        if session_id in active_agents:
+        # Cleanup, leaving alone anything a newer connection to the session set up
+        if active_agents.get(session_id, (None, None))[0] is agent:
             del active_agents[session_id]
+        if connection_manager.active_connections.get(session_id) is websocket:
+            connection_manager.disconnect(session_id)
+        await agent.aclose()
         logger.info(f"WebSocket connection closed: {session_id}")
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # The agent is I/O bound (LLM/search calls and websocket frames), so it runs on
+    # uvloop with the httptools parser when they're installed (`pip install
+    # uvicorn[standard]`); the frequent websocket sends benefit the most. Without
+    # them uvicorn falls back to asyncio and h11. Each session lives on a single
+    # websocket connection, so sessions can be spread over several worker
+    # processes (WEB_CONCURRENCY); see the README for sharing cached responses
+    # between them.
+    #
+    # To find where await time goes, profile under an async-aware profiler
+    # rather than cProfile, which misattributes time across coroutines:
+    #   python -m scalene --async --profile-only app/ -m uvicorn app.main:app
+    # Node tasks are named "node:<method>:<id>" so time maps back to node types.
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
@@ -27,3 +27,10 @@ class PerplexityCallRecord(BaseModel):
     messages: List[Dict[str, str]]
     response: Dict[str, Any]  # full response from API
     answer: str
+
+
+class PromptEmbeddingRecord(BaseModel):
+    """Record of the embedding of a cached call's prompt, for the semantic cache."""
+
+    namespace: str  # model and earlier messages the prompt was sent with (hashed)
+    embedding: List[float]  # unit-length embedding of the last message
@@ -1,6 +1,16 @@
 from typing import Any, List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, JsonValue, field_validator
+
+
+def _to_json_compatible(value: Any) -> Any:
+    """Turns the tuples and sets calculation code often produces into lists."""
+
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return [_to_json_compatible(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _to_json_compatible(item) for key, item in value.items()}
+    return value
 
 
 class CalculationSpec(BaseModel):
@@ -18,6 +28,11 @@ class CalculationResult(BaseModel):
     warnings: List[str] = Field(
         default_factory=list, description="Any warnings generated"
     )
-    result: Optional[Any] = Field(
+    result: Optional[JsonValue] = Field(
         None, description="The calculation result if successful"
     )
+
+    @field_validator("result", mode="before")
+    @classmethod
+    def coerce_result(cls, value: Any) -> Any:
+        return _to_json_compatible(value)
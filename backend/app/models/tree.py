@@ -1,7 +1,21 @@
+import sys
+from collections import deque
 from enum import Enum
-from typing import List, Optional
-
-from pydantic import BaseModel, Field
+from typing import (
+    Annotated,
+    Any,
+    Deque,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
+
+from pydantic import BaseModel, Field, JsonValue, PrivateAttr, field_validator
 
 
 class NodeType(str, Enum):
@@ -26,27 +40,68 @@ class SearchQuery(BaseModel):
 
 
 # Models for OpenAI API Response
-class InfoNodeSpec(BaseModel):
-    """LLM's specification for an info node"""
+class _NodeSpecBase(BaseModel):
+    """Fields every node spec has"""
 
     id: str = Field(description="Unique identifier for this node")
     question: str = Field(description="What we need to know")
     rationale: str = Field(description="Why we need this")
-    node_type: NodeType = Field(description="What type of node this is")
     depends_on_ids: List[str] = Field(
         default_factory=list, description="IDs of nodes we need input from"
     )
 
-    # For GATHER nodes
+    @field_validator("id")
+    @classmethod
+    def _intern_id(cls, node_id: str) -> str:
+        # Node IDs are repeated in every node that depends on them; interning them
+        # makes those references share one string instead of each parsed copy
+        return sys.intern(node_id)
+
+    @field_validator("depends_on_ids", "input_node_ids", check_fields=False)
+    @classmethod
+    def _intern_ids(cls, node_ids: Optional[List[str]]) -> Optional[List[str]]:
+        return None if node_ids is None else [sys.intern(i) for i in node_ids]
+
+
+class GatherNodeSpec(_NodeSpecBase):
+    """LLM's specification for a node that gathers information"""
+
+    node_type: Literal[NodeType.GATHER] = Field(description="What type of node this is")
     gathering_method: Optional[GatheringMethod] = None
     search_queries: Optional[List[SearchQuery]] = None
 
-    # For CALCULATE nodes
+
+class CalculateNodeSpec(_NodeSpecBase):
+    """LLM's specification for a node that calculates from other nodes"""
+
+    node_type: Literal[NodeType.CALCULATE] = Field(
+        description="What type of node this is"
+    )
     calculation_code: Optional[str] = None
     calculation_explanation: Optional[str] = None
     input_node_ids: Optional[List[str]] = None
 
 
+def _as_any_of(schema: Dict[str, Any]) -> None:
+    # Structured outputs support "anyOf" but not "oneOf" or "discriminator"; the
+    # node_type consts already tell the branches apart
+    schema["anyOf"] = schema.pop("oneOf")
+    schema.pop("discriminator", None)
+
+
+# LLM's specification for an info node; only the fields of its node type are parsed
+InfoNodeSpec = Annotated[
+    Union[GatherNodeSpec, CalculateNodeSpec],
+    Field(discriminator="node_type", json_schema_extra=_as_any_of),
+]
+
+# Node spec class by node type
+_SPEC_CLASSES: Dict[NodeType, Type[_NodeSpecBase]] = {
+    NodeType.GATHER: GatherNodeSpec,
+    NodeType.CALCULATE: CalculateNodeSpec,
+}
+
+
 class InitialInfoGraph(BaseModel):
     """Complete LLM response for information gathering plan"""
 
@@ -72,6 +127,17 @@ class SearchResultList(BaseModel):
     results: List[SearchResult] = Field(description="List of search results")
 
 
+class PageSearchResults(BaseModel):
+    """Search results found on one page of a batch of analyzed pages"""
+
+    page_idx: int = Field(description="Index of the page the results came from")
+    results: List[SearchResult] = Field(description="List of search results")
+
+
+class SearchResultListBatch(BaseModel):
+    pages: List[PageSearchResults] = Field(description="Search results for each page")
+
+
 class SearchResultWithURL(BaseModel):
     """Result of a web search, with the URL."""
 
@@ -143,7 +209,7 @@ class ProcessingNode(BaseModel):
     calculation_code: Optional[str] = None
     calculation_explanation: Optional[str] = None
     input_node_ids: Optional[List[str]] = None
-    calculation_result: Optional[str] = None
+    calculation_result: Optional[JsonValue] = None
 
     # The final value at this node
     value: Optional[str] = None
@@ -156,9 +222,136 @@ class ProcessingNode(BaseModel):
     display_order: int = Field(0)
     is_expanded: bool = Field(True)
 
+    # Caches for values derived on every websocket update
+    _query_strings: Optional[Tuple[str, ...]] = PrivateAttr(default=None)
+    _dumped_search_results: Optional[List[Dict[str, Any]]] = PrivateAttr(default=None)
+    # The results list that was dumped (kept, so it is compared by identity rather
+    # than by an id that a new list could reuse) and its length at the time
+    _dumped_search_results_of: Optional[List[SearchResultWithURL]] = PrivateAttr(
+        default=None
+    )
+    _dumped_search_results_len: int = PrivateAttr(default=0)
+
+    @classmethod
+    def from_spec(cls, spec: InfoNodeSpec) -> "ProcessingNode":
+        """
+        Build a processing node from a node spec. The spec was validated when it was
+        parsed, so this skips validation. Fields of the other node type are left at
+        their defaults.
+        """
+        return cls.model_construct(
+            **{name: getattr(spec, name) for name in type(spec).model_fields}
+        )
+
+    def to_spec(self) -> InfoNodeSpec:
+        """The node spec this node was built from, without re-validating it."""
+        spec_class = _SPEC_CLASSES[NodeType(self.node_type)]
+        return spec_class.model_construct(
+            **{name: getattr(self, name) for name in spec_class.model_fields}
+        )
+
+    @property
+    def query_strings(self) -> Tuple[str, ...]:
+        """The raw query strings of this node's search queries."""
+        if self._query_strings is None:
+            self._query_strings = tuple(q.query for q in self.search_queries or [])
+        return self._query_strings
+
+    def dump_search_results(self) -> List[Dict[str, Any]]:
+        """
+        Dumped search results, re-dumped only when the results list changes. Results
+        appended to the same list (as streamed searches do) are dumped on their own.
+        """
+
+        if not self.search_results:
+            return []
+
+        results, count = self.search_results, len(self.search_results)
+        same_list = self._dumped_search_results_of is results
+        if same_list and self._dumped_search_results_len == count:
+            return self._dumped_search_results
+
+        if same_list and self._dumped_search_results_len < count:
+            # Only new results were appended; copy so earlier dumps stay as they were
+            dumped = self._dumped_search_results + [
+                r.model_dump() for r in results[self._dumped_search_results_len :]
+            ]
+        else:
+            dumped = [r.model_dump() for r in results]
+
+        self._dumped_search_results = dumped
+        self._dumped_search_results_of = results
+        self._dumped_search_results_len = count
+        return dumped
+
 
 class ProcessingGraph(BaseModel):
     """Internal graph for processing and tracking state"""
 
     goal: str = Field(description="Original user goal")
     nodes: List[ProcessingNode] = Field(description="All nodes being processed")
+
+    # Lookup table from node ID to node, built once so dependency checks are O(1)
+    _node_by_id: Dict[str, ProcessingNode] = PrivateAttr(default_factory=dict)
+    # Reverse adjacency: node ID -> IDs of the nodes that depend on it
+    _dependents: Dict[str, List[str]] = PrivateAttr(default_factory=dict)
+    # Kahn-style scheduling state: number of unfinished dependencies per node, and
+    # IDs of nodes whose dependencies are all complete but haven't been handed out
+    _pending_deps: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _completed: Set[str] = PrivateAttr(default_factory=set)
+    _ready: Deque[str] = PrivateAttr(default_factory=deque)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._node_by_id = {node.id: node for node in self.nodes}
+        self._dependents = {node.id: [] for node in self.nodes}
+        for node in self.nodes:
+            for dep_id in node.depends_on_ids:
+                self._dependents.setdefault(dep_id, []).append(node.id)
+
+        self._completed = {
+            node.id for node in self.nodes if node.state == NodeState.COMPLETE
+        }
+        for node in self.nodes:
+            self._pending_deps[node.id] = sum(
+                dep_id not in self._completed for dep_id in node.depends_on_ids
+            )
+            if self._pending_deps[node.id] == 0 and node.state == NodeState.PENDING:
+                self._ready.append(node.id)
+
+    @classmethod
+    def from_nodes(cls, goal: str, nodes: List[ProcessingNode]) -> "ProcessingGraph":
+        """
+        Build a graph from processing nodes that are already built, without
+        re-validating them. The lookup tables are still set up by `model_post_init`.
+        """
+        return cls.model_construct(goal=goal, nodes=nodes)
+
+    @property
+    def node_by_id(self) -> Dict[str, ProcessingNode]:
+        return self._node_by_id
+
+    @property
+    def dependents(self) -> Dict[str, List[str]]:
+        return self._dependents
+
+    def mark_complete(self, node_id: str) -> None:
+        """Record that a node completed, releasing dependents that were waiting."""
+
+        if node_id in self._completed:
+            return
+        self._completed.add(node_id)
+
+        for dependent_id in self._dependents.get(node_id, []):
+            self._pending_deps[dependent_id] -= 1
+            if self._pending_deps[dependent_id] == 0:
+                self._ready.append(dependent_id)
+
+    def pop_ready(self) -> List[ProcessingNode]:
+        """Hand out every pending node whose dependencies have all completed."""
+
+        ready_nodes = []
+        while self._ready:
+            node = self._node_by_id[self._ready.popleft()]
+            if node.state == NodeState.PENDING:
+                ready_nodes.append(node)
+        return ready_nodes
@@ -1,32 +1,136 @@
+import os
+from collections.abc import Mapping
+from functools import cache, lru_cache
+from hashlib import blake2b
 from pathlib import Path
-from typing import Dict
+from string import Formatter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
-def load_prompts() -> Dict[str, Dict[str, str]]:
+class LazyPrompts(Mapping):
     """
-    Load .txt prompts under /system and /user.
+    The .txt prompts in one directory, by file stem. Only the directory listing is
+    read up front; each prompt is read (and kept) the first time it's looked up.
+    """
+
+    def __init__(self, prompts_dir: Path):
+        self._paths: Dict[str, Path] = {}
+        if prompts_dir.exists():
+            with os.scandir(prompts_dir) as entries:
+                for entry in entries:
+                    stem, ext = os.path.splitext(entry.name)
+                    if ext == ".txt" and entry.is_file():
+                        self._paths[stem] = Path(entry.path)
+        self._loaded: Dict[str, str] = {}
+
+    def __getitem__(self, name: str) -> str:
+        if name not in self._loaded:
+            self._loaded[name] = self._paths[name].read_text().strip()
+        return self._loaded[name]
+
+    def fingerprint(self, name: str) -> str:
+        """
+        Short hash of a prompt's text, for keys of cached results that depend on the
+        prompt, so editing the prompt invalidates them.
+        """
+        return blake2b(self[name].encode("utf-8"), digest_size=8).hexdigest()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+def load_prompts() -> Dict[str, LazyPrompts]:
+    """
+    Index .txt prompts under /system and /user. Prompts are read on first use.
     """
-    prompts = {"system": dict(), "user": dict()}
     prompts_dir = Path(__file__).parent
+    return {
+        "system": LazyPrompts(prompts_dir / "system"),
+        "user": LazyPrompts(prompts_dir / "user"),
+    }
+
+
+@cache
+def get_prompts() -> Dict[str, LazyPrompts]:
+    """The prompts, indexed on first call."""
+    return load_prompts()
+
+
+def __getattr__(name: str) -> Any:
+    # `PROMPTS` is indexed when it's first imported or used, not on import of this
+    # module
+    if name == "PROMPTS":
+        return get_prompts()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class PromptTemplate:
+    """
+    A prompt with `{field}` placeholders that is parsed once up front, so rendering
+    is a single join instead of `str.format` re-parsing the whole prompt each call.
+    Renders exactly like `str.format`.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+
+        # Alternating literal text and field names, ending with a literal. Set to
+        # None if the template uses anything beyond plain `{name}` fields (format
+        # specs, conversions, indexing), in which case we defer to str.format.
+        self._parts: Optional[Tuple[List[str], List[str]]] = None
+
+        literals: List[str] = []
+        fields: List[str] = []
+        pending_literal = ""
+        for literal, field_name, format_spec, conversion in Formatter().parse(template):
+            pending_literal += literal
+            if field_name is None:
+                continue
+            if format_spec or conversion or not field_name.isidentifier():
+                return
+            literals.append(pending_literal)
+            fields.append(field_name)
+            pending_literal = ""
+        literals.append(pending_literal)
+
+        self._parts = (literals, fields)
+
+    def format(self, **kwargs: Any) -> str:
+        if self._parts is None:
+            return self.template.format(**kwargs)
+
+        literals, fields = self._parts
+        pieces = [literals[0]]
+        for field_name, literal in zip(fields, literals[1:]):
+            value = kwargs[field_name]
+            pieces.append(value if type(value) is str else format(value, ""))
+            pieces.append(literal)
+        return "".join(pieces)
+
+    def __str__(self) -> str:
+        return self.template
+
+
+def format_bullets(items: Iterable[str]) -> str:
+    """Format items for a prompt as a "- item" list, one per line."""
+    return _format_bullets(tuple(items))
 
-    def load_prompts_from_directory(base_dir: Path) -> dict:
-        d = dict()
-        for item in base_dir.iterdir():
-            if item.is_file() and item.suffix == ".txt":
-                d[item.stem] = item.read_text().strip()
-        return d
 
-    # System
-    system_dir = prompts_dir / "system"
-    if system_dir.exists():
-        prompts["system"] = load_prompts_from_directory(system_dir)
+def format_facts(facts: Dict[str, str]) -> str:
+    """Format facts for a prompt as a "- name: value" list, one per line."""
+    return _format_facts(tuple(facts.items()))
 
-    # User
-    user_dir = prompts_dir / "user"
-    if user_dir.exists():
-        prompts["user"] = load_prompts_from_directory(user_dir)
 
-    return prompts
+# Handlers retrying the same question format the same searches and facts over and
+# over, so the formatted lists are cached
+@lru_cache(maxsize=256)
+def _format_bullets(items: Tuple[str, ...]) -> str:
+    return "\n".join(f"- {item}" for item in items)
 
 
-PROMPTS = load_prompts()
+@lru_cache(maxsize=256)
+def _format_facts(facts: Tuple[Tuple[str, str], ...]) -> str:
+    return "\n".join(f"- {k}: {v}" for k, v in facts)
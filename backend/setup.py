@@ -4,4 +4,21 @@ setup(
     name="idea-explorer",
     version="0.1",
     packages=find_packages(),
+    install_requires=[
+        "cachetools",
+        "fastapi",
+        "httpx",
+        "lxml",
+        "openai>=1.0",
+        "orjson",
+        "pydantic>=2.5",  # JsonValue
+        "readability-lxml",
+        "uvicorn",
+    ],
+    extras_require={
+        # Shares cached responses between worker processes (see REDIS_URL)
+        "redis": ["redis"],
+        # uvloop and httptools, which uvicorn uses when they're installed
+        "standard": ["uvicorn[standard]"],
+    },
 )
@@ -81,10 +81,13 @@ export const ProcessingStatus: React.FC<ProcessingStatusProps> = ({
                             language="python"
                             explanation={node.calculation_explanation}
                         />
-                        {node.calculation_result && (
+                        {node.calculation_result != null && (
                             <div className="mt-2 p-2 bg-green-50 rounded-md">
                                 <p className="text-sm font-medium text-green-800">
-                                    Result: {node.calculation_result}
+                                    Result:{' '}
+                                    {typeof node.calculation_result === 'string'
+                                        ? node.calculation_result
+                                        : JSON.stringify(node.calculation_result)}
                                 </p>
                             </div>
                         )}
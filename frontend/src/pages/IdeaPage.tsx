@@ -24,6 +24,10 @@ export const IdeaPage: React.FC = () => {
         console.log('WebSocket message received:', data); // Debug log
 
         switch (data.type) {
+            case 'batch':
+                data.updates.forEach(handleWebSocketMessage);
+                break;
+
             case 'initial_key_info_graph':
                 console.log('Setting initial key info graph:', data.graph);
                 setKeyInfoGraph(data.graph);
@@ -113,7 +117,13 @@ export const IdeaPage: React.FC = () => {
                 ...node,
                 value: update.value,
                 value_source: update.value_source,
-                search_results: update.search_results,
+                // Partial updates only carry the results after the ones we have
+                search_results: update.search_results_offset
+                    ? [
+                        ...(node.search_results || []).slice(0, update.search_results_offset),
+                        ...update.search_results
+                    ]
+                    : update.search_results,
                 calculation_result: update.calculation_result
             };
         };
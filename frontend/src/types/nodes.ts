@@ -13,6 +13,15 @@ export enum NodeState {
     BLOCKED = 'blocked',
 }
 
+// Any JSON value a calculation can produce
+export type JsonValue =
+    | string
+    | number
+    | boolean
+    | null
+    | JsonValue[]
+    | { [key: string]: JsonValue };
+
 export enum GatheringMethod {
     WEB_SEARCH = 'web_search',
     ASK_USER = 'ask_user',
@@ -75,7 +84,7 @@ export interface ProcessingNode {
     calculation_code?: string;
     calculation_explanation?: string;
     input_node_ids?: string[];
-    calculation_result?: string;
+    calculation_result?: JsonValue;
 
     // Final value
     value?: string;